@@ -4,8 +4,14 @@ setup(
     name="Telegram Desktop decrypter",
     version="1.2",
     packages=['tdesktop_decrypter'],
-    install_requires=['tgcrypto'],
+    extras_require={
+        'tgcrypto': ['tgcrypto'],
+        'cryptography': ['cryptography'],
+    },
     entry_points={
-        'console_scripts': ['tdesktop-decrypter=tdesktop_decrypter:main']
+        'console_scripts': [
+            'tdesktop-decrypter=tdesktop_decrypter:main',
+            'tdesktop-decrypter-client=tdesktop_decrypter.client:main',
+        ]
     }
 )
@@ -1 +1,6 @@
-from .cli import main
\ No newline at end of file
+def main():
+    # The CLI is imported on call, so that light modules such as
+    # tdesktop_decrypter.client do not pay for its imports.
+    from .cli import main
+
+    main()
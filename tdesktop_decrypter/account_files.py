@@ -0,0 +1,173 @@
+import re
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from tdesktop_decrypter.qt import QtCursor, read_qt_byte_array_view
+from tdesktop_decrypter.crypto import decrypt_local
+from tdesktop_decrypter.file_io import TdataFileIo, TdataFileSystem
+from tdesktop_decrypter.key_cache import DerivedKeyCache
+from tdesktop_decrypter.decrypter import (
+    TdataReader,
+    compose_account_name,
+    compute_data_name_key,
+)
+
+MAP_FILE_KEY = "map"
+
+# Files of the account folder are named after their 64-bit file key.
+FILE_KEY_RE = re.compile(r"^[0-9A-F]{16}s?$")
+
+
+class DecryptedFile:
+    def __init__(self):
+        self.version: int = None
+        self.data: memoryview = None
+
+    def __repr__(self):
+        return f"DecryptedFile(version={self.version}, size={len(self.data)})"
+
+
+class AccountFiles:
+    def __init__(self):
+        self.index: int = None
+        self.files: Dict[str, DecryptedFile] = {}
+        # File key to the error of every file which could not be decrypted.
+        self.errors: Dict[str, str] = {}
+
+    def __repr__(self):
+        return (
+            f"AccountFiles(index={self.index}, files={list(self.files)}, "
+            f"errors={self.errors})"
+        )
+
+
+class AccountFilesReader:
+    """
+    Decrypts every encrypted file of an account: the MTP settings file in the
+    tdata/ folder and the files of the account folder named after the same key
+    (the map file and the files keyed by the map).
+    Files are found by listing the account folder rather than by parsing the map,
+    so files the map no longer references are included.
+    """
+
+    def __init__(
+        self,
+        io: TdataFileIo,
+        index: int,
+        dataname: str,
+        executor: Executor = None,
+        workers: int = None,
+    ):
+        """
+        Files are read and decrypted in executor, by default in a new
+        thread pool of workers threads.
+        """
+        self._io = io
+        self._index = index
+        self._dataname_key = compute_data_name_key(
+            compose_account_name(dataname, index)
+        )
+        self._executor = executor
+        self._workers = workers
+
+    def list_file_keys(self) -> List[str]:
+        """
+        Keys of the account's files: the account folder name for the MTP
+        settings file, "map" and the file keys of the account folder.
+        """
+        keys = [self._dataname_key]
+
+        try:
+            names = self._io.list_files(self._dataname_key)
+        except FileNotFoundError:
+            # No account folder.
+            return keys
+
+        if "maps" in names or "map" in names:
+            keys.append(MAP_FILE_KEY)
+
+        # "s" suffixed and plain copies of a file share the key.
+        keys.extend(
+            sorted({name.rstrip("s") for name in names if FILE_KEY_RE.match(name)})
+        )
+        return keys
+
+    def read(self, local_key: bytes) -> AccountFiles:
+        account_files = AccountFiles()
+        account_files.index = self._index
+
+        keys = self.list_file_keys()
+
+        def read(key: str) -> Tuple[str, Optional[DecryptedFile], Optional[str]]:
+            try:
+                return key, self.read_file(key, local_key), None
+            except Exception as exc:
+                return key, None, f"{type(exc).__name__}: {exc}"
+
+        if self._executor is not None:
+            results = list(self._executor.map(read, keys))
+        else:
+            with ThreadPoolExecutor(self._workers) as executor:
+                results = list(executor.map(read, keys))
+
+        for key, decrypted_file, error in results:
+            if error is None:
+                account_files.files[key] = decrypted_file
+            else:
+                account_files.errors[key] = error
+
+        return account_files
+
+    def read_file(self, key: str, local_key: bytes) -> DecryptedFile:
+        decrypted_file = DecryptedFile()
+
+        if key == self._dataname_key:
+            decrypted_file.version, decrypted_file.data = self._io.read_encrypted_file(
+                key, local_key
+            )
+        elif key == MAP_FILE_KEY:
+            decrypted_file.version, decrypted_file.data = self._read_map(local_key)
+        else:
+            decrypted_file.version, decrypted_file.data = self._io.read_encrypted_file(
+                f"{self._dataname_key}/{key}", local_key
+            )
+
+        return decrypted_file
+
+    def _read_map(self, local_key: bytes) -> Tuple[int, memoryview]:
+        map_tdf = self._io.read_tdf_file(f"{self._dataname_key}/{MAP_FILE_KEY}")
+        stream = QtCursor(map_tdf.encrypted_data)
+
+        # Salt and encrypted key of the legacy format, empty since key_data.
+        read_qt_byte_array_view(stream)
+        read_qt_byte_array_view(stream)
+        map_encrypted = read_qt_byte_array_view(stream)
+
+        return map_tdf.version, decrypt_local(map_encrypted, local_key)
+
+
+def read_all_account_files(
+    io: Union[str, TdataFileIo],
+    passcode: str = None,
+    dataname: str = None,
+    key_cache: DerivedKeyCache = None,
+    workers: int = None,
+) -> Dict[int, AccountFiles]:
+    """
+    Decrypts the files of every account of a tdata/ folder
+    in one thread pool of workers threads.
+    io is either the path to the tdata/ folder or TdataFileIo object
+    """
+    if isinstance(io, str):
+        io = TdataFileSystem(io)
+
+    reader = TdataReader(io, dataname, key_cache)
+    local_key, account_indexes = reader.read_key_data(passcode)
+    dataname = dataname or TdataReader.DEFAULT_DATANAME
+
+    with ThreadPoolExecutor(workers) as executor:
+        return {
+            index: AccountFilesReader(io, index, dataname, executor).read(local_key)
+            for index in account_indexes
+        }
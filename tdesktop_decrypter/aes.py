@@ -0,0 +1,209 @@
+"""
+Pure Python AES-256 block cipher with T-tables, the fallback when
+no native AES implementation is installed.
+Blocks are 128-bit big-endian integers.
+"""
+
+from typing import List, Tuple
+
+ROUNDS = 14
+
+
+def _xtime(a: int) -> int:
+    a <<= 1
+    return a ^ 0x11B if a & 0x100 else a
+
+
+def _mul(a: int, b: int) -> int:
+    result = 0
+
+    while b:
+        if b & 1:
+            result ^= a
+
+        a = _xtime(a)
+        b >>= 1
+
+    return result
+
+
+def _build_sbox() -> Tuple[List[int], List[int]]:
+    # Powers of the generator 3 give the multiplicative inverses in GF(2^8).
+    exp = [0] * 255
+    log = [0] * 256
+    a = 1
+    for i in range(255):
+        exp[i] = a
+        log[a] = i
+        a ^= _xtime(a)
+
+    sbox = [0] * 256
+    inv_sbox = [0] * 256
+
+    for x in range(256):
+        inv = 0 if x == 0 else exp[(255 - log[x]) % 255]
+
+        s = inv
+        for shift in range(1, 5):
+            s ^= ((inv << shift) | (inv >> (8 - shift))) & 0xFF
+        s ^= 0x63
+
+        sbox[x] = s
+        inv_sbox[s] = x
+
+    return sbox, inv_sbox
+
+
+def _rotr(word: int, bits: int) -> int:
+    return ((word >> bits) | (word << (32 - bits))) & 0xFFFFFFFF
+
+
+def _build_tables(column) -> List[List[int]]:
+    t0 = [
+        (a << 24) | (b << 16) | (c << 8) | d for a, b, c, d in map(column, range(256))
+    ]
+    return [t0] + [[_rotr(word, bits) for word in t0] for bits in (8, 16, 24)]
+
+
+SBOX, INV_SBOX = _build_sbox()
+
+TE = _build_tables(
+    lambda x: (_mul(SBOX[x], 2), SBOX[x], SBOX[x], _mul(SBOX[x], 3))
+)
+TD = _build_tables(
+    lambda x: (
+        _mul(INV_SBOX[x], 14),
+        _mul(INV_SBOX[x], 9),
+        _mul(INV_SBOX[x], 13),
+        _mul(INV_SBOX[x], 11),
+    )
+)
+
+
+def expand_key(key: bytes) -> List[int]:
+    """
+    Returns the 60 words of the AES-256 encryption key schedule.
+    """
+    if len(key) != 32:
+        raise ValueError("AES-256 key must be 32 bytes")
+
+    words = [int.from_bytes(key[i : i + 4], "big") for i in range(0, 32, 4)]
+    rcon = 1
+
+    for i in range(8, 4 * (ROUNDS + 1)):
+        temp = words[i - 1]
+
+        if i % 8 == 0:
+            temp = (
+                (SBOX[(temp >> 16) & 0xFF] << 24)
+                | (SBOX[(temp >> 8) & 0xFF] << 16)
+                | (SBOX[temp & 0xFF] << 8)
+                | SBOX[temp >> 24]
+            ) ^ (rcon << 24)
+            rcon = _xtime(rcon)
+        elif i % 8 == 4:
+            temp = (
+                (SBOX[temp >> 24] << 24)
+                | (SBOX[(temp >> 16) & 0xFF] << 16)
+                | (SBOX[(temp >> 8) & 0xFF] << 8)
+                | SBOX[temp & 0xFF]
+            )
+
+        words.append(words[i - 8] ^ temp)
+
+    return words
+
+
+def expand_decryption_key(key: bytes) -> List[int]:
+    """
+    Key schedule of the equivalent inverse cipher: rounds in reverse order,
+    InvMixColumns applied to all but the first and last round keys.
+    """
+    words = expand_key(key)
+    rounds = [words[i : i + 4] for i in range(0, len(words), 4)][::-1]
+
+    td0, td1, td2, td3 = TD
+    decryption_words = list(rounds[0])
+
+    for round_key in rounds[1:-1]:
+        decryption_words.extend(
+            td0[SBOX[w >> 24]]
+            ^ td1[SBOX[(w >> 16) & 0xFF]]
+            ^ td2[SBOX[(w >> 8) & 0xFF]]
+            ^ td3[SBOX[w & 0xFF]]
+            for w in round_key
+        )
+
+    decryption_words.extend(rounds[-1])
+    return decryption_words
+
+
+def encrypt_block(block: int, rk: List[int]) -> int:
+    te0, te1, te2, te3 = TE
+    sbox = SBOX
+
+    s0 = (block >> 96) ^ rk[0]
+    s1 = ((block >> 64) & 0xFFFFFFFF) ^ rk[1]
+    s2 = ((block >> 32) & 0xFFFFFFFF) ^ rk[2]
+    s3 = (block & 0xFFFFFFFF) ^ rk[3]
+
+    for r in range(4, 4 * ROUNDS, 4):
+        s0, s1, s2, s3 = (
+            te0[s0 >> 24] ^ te1[(s1 >> 16) & 0xFF] ^ te2[(s2 >> 8) & 0xFF] ^ te3[s3 & 0xFF] ^ rk[r],
+            te0[s1 >> 24] ^ te1[(s2 >> 16) & 0xFF] ^ te2[(s3 >> 8) & 0xFF] ^ te3[s0 & 0xFF] ^ rk[r + 1],
+            te0[s2 >> 24] ^ te1[(s3 >> 16) & 0xFF] ^ te2[(s0 >> 8) & 0xFF] ^ te3[s1 & 0xFF] ^ rk[r + 2],
+            te0[s3 >> 24] ^ te1[(s0 >> 16) & 0xFF] ^ te2[(s1 >> 8) & 0xFF] ^ te3[s2 & 0xFF] ^ rk[r + 3],
+        )
+
+    r = 4 * ROUNDS
+    return (
+        (
+            (sbox[s0 >> 24] << 24 | sbox[(s1 >> 16) & 0xFF] << 16 | sbox[(s2 >> 8) & 0xFF] << 8 | sbox[s3 & 0xFF]) ^ rk[r]
+        ) << 96
+        | (
+            (sbox[s1 >> 24] << 24 | sbox[(s2 >> 16) & 0xFF] << 16 | sbox[(s3 >> 8) & 0xFF] << 8 | sbox[s0 & 0xFF]) ^ rk[r + 1]
+        ) << 64
+        | (
+            (sbox[s2 >> 24] << 24 | sbox[(s3 >> 16) & 0xFF] << 16 | sbox[(s0 >> 8) & 0xFF] << 8 | sbox[s1 & 0xFF]) ^ rk[r + 2]
+        ) << 32
+        | (
+            (sbox[s3 >> 24] << 24 | sbox[(s0 >> 16) & 0xFF] << 16 | sbox[(s1 >> 8) & 0xFF] << 8 | sbox[s2 & 0xFF]) ^ rk[r + 3]
+        )
+    )
+
+
+def decrypt_block(block: int, rk: List[int]) -> int:
+    """
+    rk is a key schedule from expand_decryption_key.
+    """
+    td0, td1, td2, td3 = TD
+    inv_sbox = INV_SBOX
+
+    s0 = (block >> 96) ^ rk[0]
+    s1 = ((block >> 64) & 0xFFFFFFFF) ^ rk[1]
+    s2 = ((block >> 32) & 0xFFFFFFFF) ^ rk[2]
+    s3 = (block & 0xFFFFFFFF) ^ rk[3]
+
+    for r in range(4, 4 * ROUNDS, 4):
+        s0, s1, s2, s3 = (
+            td0[s0 >> 24] ^ td1[(s3 >> 16) & 0xFF] ^ td2[(s2 >> 8) & 0xFF] ^ td3[s1 & 0xFF] ^ rk[r],
+            td0[s1 >> 24] ^ td1[(s0 >> 16) & 0xFF] ^ td2[(s3 >> 8) & 0xFF] ^ td3[s2 & 0xFF] ^ rk[r + 1],
+            td0[s2 >> 24] ^ td1[(s1 >> 16) & 0xFF] ^ td2[(s0 >> 8) & 0xFF] ^ td3[s3 & 0xFF] ^ rk[r + 2],
+            td0[s3 >> 24] ^ td1[(s2 >> 16) & 0xFF] ^ td2[(s1 >> 8) & 0xFF] ^ td3[s0 & 0xFF] ^ rk[r + 3],
+        )
+
+    r = 4 * ROUNDS
+    return (
+        (
+            (inv_sbox[s0 >> 24] << 24 | inv_sbox[(s3 >> 16) & 0xFF] << 16 | inv_sbox[(s2 >> 8) & 0xFF] << 8 | inv_sbox[s1 & 0xFF]) ^ rk[r]
+        ) << 96
+        | (
+            (inv_sbox[s1 >> 24] << 24 | inv_sbox[(s0 >> 16) & 0xFF] << 16 | inv_sbox[(s3 >> 8) & 0xFF] << 8 | inv_sbox[s2 & 0xFF]) ^ rk[r + 1]
+        ) << 64
+        | (
+            (inv_sbox[s2 >> 24] << 24 | inv_sbox[(s1 >> 16) & 0xFF] << 16 | inv_sbox[(s0 >> 8) & 0xFF] << 8 | inv_sbox[s3 & 0xFF]) ^ rk[r + 2]
+        ) << 32
+        | (
+            (inv_sbox[s3 >> 24] << 24 | inv_sbox[(s2 >> 16) & 0xFF] << 16 | inv_sbox[(s1 >> 8) & 0xFF] << 8 | inv_sbox[s0 & 0xFF]) ^ rk[r + 3]
+        )
+    )
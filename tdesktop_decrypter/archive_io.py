@@ -0,0 +1,221 @@
+import tarfile
+import zipfile
+import posixpath
+import threading
+
+from typing import Dict, Iterator, List
+
+from tdesktop_decrypter.qt import current_limits
+from tdesktop_decrypter.file_io import TdataFileIo
+from tdesktop_decrypter.key_cache import DerivedKeyCache
+from tdesktop_decrypter.decrypter import TdataReader
+from tdesktop_decrypter.batch import BatchResult
+from tdesktop_decrypter.stats import instrumented
+
+
+class TdataArchiveException(Exception):
+    pass
+
+
+def _normalize_member_name(name: str) -> str:
+    name = name.replace("\\", "/")
+
+    while name.startswith("./"):
+        name = name[2:]
+
+    return name.lstrip("/")
+
+
+class TdataArchive:
+    """
+    An archive holding one or more tdata/ folders.
+    The member index is built once when the archive is opened,
+    members are read only when they are requested.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._members: Dict[str, object] = {}
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def has_member(self, name: str) -> bool:
+        return name in self._members
+
+    def member_names(self) -> List[str]:
+        return list(self._members)
+
+    @instrumented("read_file", size=lambda result, *_: len(result))
+    def read_member(self, name: str) -> bytearray:
+        try:
+            member = self._members[name]
+        except KeyError:
+            raise FileNotFoundError(name) from None
+
+        limits = current_limits()
+        if limits is not None:
+            limits.check_total_bytes(self._member_size(member))
+
+        with self._lock:
+            return self._read_member(member)
+
+    def _member_size(self, member) -> int:
+        raise NotImplementedError()
+
+    def _read_member(self, member) -> bytearray:
+        raise NotImplementedError()
+
+    def tdata_dirs(self) -> List[str]:
+        """
+        Folders of the archive holding a key_* file, "" is the archive root.
+        They are in member order: a compressed tar is decompressed up to every
+        member read, folders in archive order keep the reads moving forward.
+        """
+        dirs = dict.fromkeys(
+            posixpath.dirname(name)
+            for name in self._members
+            if posixpath.basename(name).startswith("key_")
+        )
+        return list(dirs)
+
+    def file_io(self, base_path: str = "") -> "ArchiveTdataFileIo":
+        return ArchiveTdataFileIo(self, base_path)
+
+    def close(self):
+        raise NotImplementedError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ZipTdataArchive(TdataArchive):
+    def __init__(self, path: str):
+        super().__init__(path)
+
+        self._zip = zipfile.ZipFile(path)
+        self._members = {
+            _normalize_member_name(info.filename): info
+            for info in self._zip.infolist()
+            if not info.is_dir()
+        }
+
+    def _member_size(self, member: zipfile.ZipInfo) -> int:
+        return member.file_size
+
+    def _read_member(self, member: zipfile.ZipInfo) -> bytearray:
+        data = bytearray(member.file_size)
+
+        with self._zip.open(member) as f:
+            size = f.readinto(data)
+
+        del data[size:]
+        return data
+
+    def close(self):
+        self._zip.close()
+
+
+class TarTdataArchive(TdataArchive):
+    def __init__(self, path: str):
+        super().__init__(path)
+
+        # Compressed tars are decompressed once while indexing and again
+        # up to every requested member, uncompressed tars are seeked.
+        self._tar = tarfile.open(path)
+        self._members = {
+            _normalize_member_name(info.name): info
+            for info in self._tar.getmembers()
+            if info.isfile()
+        }
+
+    def _member_size(self, member: tarfile.TarInfo) -> int:
+        return member.size
+
+    def _read_member(self, member: tarfile.TarInfo) -> bytearray:
+        data = bytearray(member.size)
+
+        f = self._tar.extractfile(member)
+        size = f.readinto(data)
+
+        del data[size:]
+        return data
+
+    def close(self):
+        self._tar.close()
+
+
+def open_tdata_archive(path: str) -> TdataArchive:
+    if zipfile.is_zipfile(path):
+        return ZipTdataArchive(path)
+
+    if tarfile.is_tarfile(path):
+        return TarTdataArchive(path)
+
+    raise TdataArchiveException(f"not a zip or tar archive: {path}")
+
+
+class ArchiveTdataFileIo(TdataFileIo):
+    def __init__(self, archive: TdataArchive, base_path: str = ""):
+        super().__init__()
+
+        self._archive = archive
+        self._base_path = _normalize_member_name(base_path).rstrip("/")
+
+    def _member_name(self, path: str) -> str:
+        return posixpath.join(self._base_path, path) if self._base_path else path
+
+    def read_file(self, path: str) -> bytearray:
+        return self._archive.read_member(self._member_name(path))
+
+    def list_files(self, path: str) -> List[str]:
+        prefix = self._member_name(path).rstrip("/")
+        prefix = prefix + "/" if prefix else ""
+
+        names = [
+            name[len(prefix) :]
+            for name in self._archive.member_names()
+            if name.startswith(prefix) and "/" not in name[len(prefix) :]
+        ]
+        if not names:
+            raise FileNotFoundError(path)
+
+        return names
+
+    def tdf_candidates(self, path: str) -> List[str]:
+        # Candidates are resolved from the index, absent members are never opened.
+        return [
+            candidate
+            for candidate in super().tdf_candidates(path)
+            if self._archive.has_member(self._member_name(candidate))
+        ]
+
+
+def read_archive(
+    path: str,
+    passcode: str = None,
+    key_cache: DerivedKeyCache = None,
+    with_settings: bool = True,
+    with_stats: bool = False,
+) -> Iterator[BatchResult]:
+    """
+    Reads every tdata/ folder of an archive with a single open.
+    BatchResult.path is the archive path joined with the folder inside it.
+    """
+    with open_tdata_archive(path) as archive:
+        for tdata_dir in archive.tdata_dirs():
+            result = BatchResult()
+            result.path = posixpath.join(path, tdata_dir) if tdata_dir else path
+
+            try:
+                reader = TdataReader(archive.file_io(tdata_dir), key_cache=key_cache)
+                result.parsed_tdata = reader.read(passcode, with_settings, with_stats)
+            except Exception as exc:
+                result.error = f"{type(exc).__name__}: {exc}"
+
+            yield result
@@ -0,0 +1,185 @@
+import asyncio
+
+from contextvars import copy_context
+from concurrent.futures import Executor
+from typing import Iterable, List, Optional, Tuple, Union
+
+from tdesktop_decrypter.tdf import RawTdfFile
+from tdesktop_decrypter.qt import QtCursor
+from tdesktop_decrypter.async_file_io import AsyncTdataFileIo, AsyncTdataFileSystem
+from tdesktop_decrypter.file_io import decrypt_encrypted_tdf
+from tdesktop_decrypter.key_cache import DerivedKeyCache
+from tdesktop_decrypter.settings import SettingsIndex, index_settings_blocks
+from tdesktop_decrypter.storage import (
+    decrypt_key_data_tdf,
+    read_key_data_accounts,
+    decrypt_settings_tdf,
+)
+from tdesktop_decrypter.decrypter import (
+    ParsedTdata,
+    ParsedAccount,
+    TdataReader,
+    NoKeyFileException,
+    compose_account_name,
+    compute_data_name_key,
+    decode_settings,
+    read_mtp_data_settings,
+)
+from tdesktop_decrypter.batch import BatchResult
+
+
+# CPU-bound steps run in the executor, a thread pool: they run in copies of
+# the caller's context, so parse_limits and collect_stats apply to them.
+
+
+def _decrypt_key_data(
+    passcode: bytes, key_data_tdf: RawTdfFile, key_cache: Optional[DerivedKeyCache]
+) -> Tuple[bytes, List[int]]:
+    local_key, account_indexes_data = decrypt_key_data_tdf(
+        passcode, key_data_tdf, key_cache
+    )
+    account_indexes, _ = read_key_data_accounts(QtCursor(account_indexes_data))
+    return local_key, account_indexes
+
+
+def _decrypt_settings(
+    settings_tdf: RawTdfFile, key_cache: Optional[DerivedKeyCache]
+) -> SettingsIndex:
+    settings_decrypted = decrypt_settings_tdf(settings_tdf, key_cache)
+    return index_settings_blocks(settings_tdf.version, QtCursor(settings_decrypted))
+
+
+def _decrypt_account(
+    index: int, account_tdf: RawTdfFile, local_key: bytes
+) -> ParsedAccount:
+    mtp_data_settings = decrypt_encrypted_tdf(account_tdf, local_key)
+
+    parsed_account = ParsedAccount()
+    parsed_account.index = index
+    parsed_account.mtp_data = read_mtp_data_settings(
+        account_tdf.version, mtp_data_settings
+    )
+    return parsed_account
+
+
+class AsyncTdataReader:
+    def __init__(
+        self,
+        io: Union[str, AsyncTdataFileIo],
+        dataname: str = None,
+        key_cache: DerivedKeyCache = None,
+        executor: Executor = None,
+    ):
+        """
+        io is either the path to the tdata/ folder or AsyncTdataFileIo object
+        executor is a thread pool running key derivation and decryption,
+        defaults to the event loop's executor
+        """
+
+        if isinstance(io, str):
+            io = AsyncTdataFileSystem(io)
+
+        self._io = io
+        self._dataname = dataname or TdataReader.DEFAULT_DATANAME
+        self._key_cache = key_cache
+        self._executor = executor
+
+    async def read(self, passcode: str = None, with_settings: bool = True) -> ParsedTdata:
+        """
+        Settings and key_data are read concurrently, then all account files.
+        """
+        parsed_tdata = ParsedTdata()
+
+        if with_settings:
+            settings, (local_key, account_indexes) = await asyncio.gather(
+                self.read_settings(), self.read_key_data(passcode)
+            )
+            # Decoded in the executor, as TdataReader.read does.
+            parsed_tdata.settings = await self._run(decode_settings, settings)
+        else:
+            local_key, account_indexes = await self.read_key_data(passcode)
+
+        accounts = await asyncio.gather(
+            *(self.read_account(index, local_key) for index in account_indexes)
+        )
+
+        parsed_tdata.accounts = {account.index: account for account in accounts}
+        return parsed_tdata
+
+    async def read_key_data(self, passcode: str = None) -> Tuple[bytes, List[int]]:
+        if passcode is None:
+            passcode = ""
+
+        try:
+            key_data_tdf = await self._io.read_tdf_file(self._key_data_name())
+        except FileNotFoundError as exc:
+            raise NoKeyFileException("no key file") from exc
+
+        return await self._run(
+            _decrypt_key_data, passcode.encode(), key_data_tdf, self._key_cache
+        )
+
+    async def read_settings(self) -> Optional[SettingsIndex]:
+        try:
+            settings_tdf = await self._io.read_tdf_file("settings")
+        except FileNotFoundError:
+            # No settings file.
+            return None
+
+        return await self._run(_decrypt_settings, settings_tdf, self._key_cache)
+
+    async def read_account(self, index: int, local_key: bytes) -> ParsedAccount:
+        account_name = compose_account_name(self._dataname, index)
+        account_tdf = await self._io.read_tdf_file(compute_data_name_key(account_name))
+        return await self._run(_decrypt_account, index, account_tdf, local_key)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, copy_context().run, func, *args
+        )
+
+    def _key_data_name(self):
+        return "key_" + self._dataname
+
+
+async def read_tdata_async(
+    path: str,
+    passcode: str = None,
+    key_cache: DerivedKeyCache = None,
+    with_settings: bool = True,
+    executor: Executor = None,
+) -> BatchResult:
+    result = BatchResult()
+    result.path = path
+
+    try:
+        reader = AsyncTdataReader(path, key_cache=key_cache, executor=executor)
+        result.parsed_tdata = await reader.read(passcode, with_settings)
+    except Exception as exc:
+        result.error = f"{type(exc).__name__}: {exc}"
+
+    return result
+
+
+async def read_tdata_many_async(
+    paths: Iterable[str],
+    passcode: str = None,
+    concurrency: int = 16,
+    key_cache: DerivedKeyCache = None,
+    with_settings: bool = True,
+    executor: Executor = None,
+) -> List[BatchResult]:
+    """
+    Reads many tdata directories on the running loop, at most concurrency at a time.
+    Results are returned in input order, failures are reported in BatchResult.error.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read(path: str) -> BatchResult:
+        async with semaphore:
+            return await read_tdata_async(
+                path, passcode, key_cache, with_settings, executor
+            )
+
+    return await asyncio.gather(*(read(path) for path in paths))
@@ -0,0 +1,61 @@
+import asyncio
+
+from contextvars import copy_context
+from concurrent.futures import Executor
+from typing import List
+
+from tdesktop_decrypter.tdf import RawTdfFile, parse_raw_tdf
+from tdesktop_decrypter.file_io import TdataFileIo, TdataFileSystem
+
+
+class AsyncTdataFileIo:
+    async def read_file(self, path: str) -> bytes:
+        '''
+        Asynchronous counterpart of TdataFileIo.read_file.
+        Returns the file's data (any bytes-like object) if the file exists,
+        otherwise raises FileNotFoundError.
+        '''
+        raise NotImplementedError()
+
+    def tdf_candidates(self, path: str) -> List[str]:
+        '''
+        Counterpart of TdataFileIo.tdf_candidates.
+        '''
+        return [path + "s", path]
+
+    async def read_tdf_file(self, path: str) -> RawTdfFile:
+        for candidate in self.tdf_candidates(path):
+            try:
+                return parse_raw_tdf(await self.read_file(candidate))
+            except FileNotFoundError:
+                pass
+
+        raise FileNotFoundError(path)
+
+
+class ExecutorTdataFileIo(AsyncTdataFileIo):
+    '''
+    Runs the reads of a synchronous TdataFileIo in a thread pool executor,
+    by default the event loop's one, in copies of the caller's context.
+    '''
+
+    def __init__(self, io: TdataFileIo, executor: Executor = None):
+        super().__init__()
+
+        self._io = io
+        self._executor = executor
+
+    def tdf_candidates(self, path: str) -> List[str]:
+        # The wrapped io may narrow the candidates, e.g. from a cached listing.
+        return self._io.tdf_candidates(path)
+
+    async def read_file(self, path: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, copy_context().run, self._io.read_file, path
+        )
+
+
+class AsyncTdataFileSystem(ExecutorTdataFileIo):
+    def __init__(self, base_path: str, executor: Executor = None):
+        super().__init__(TdataFileSystem(base_path), executor)
@@ -0,0 +1,189 @@
+import glob
+
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, Iterator, List, Optional
+
+from tdesktop_decrypter.qt import ParseLimits, parse_limits
+from tdesktop_decrypter.file_io import ListingTdataFileSystem
+from tdesktop_decrypter.decrypter import ParsedTdata, TdataReader
+from tdesktop_decrypter.key_cache import DerivedKeyCache
+from tdesktop_decrypter.discovery import TdataDiscovery
+from tdesktop_decrypter.sweep_cache import SweepCache
+from tdesktop_decrypter.dedup import DedupStats, TdfDedupCache
+
+
+class BatchResult:
+    def __init__(self):
+        self.path: str = None
+        self.parsed_tdata: Optional[ParsedTdata] = None
+        self.error: Optional[str] = None
+        self.dedup: Optional[DedupStats] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return f"BatchResult(path={self.path!r}, error={self.error!r})"
+
+
+def read_manifest(manifest_path: str) -> List[str]:
+    """
+    Reads a manifest file with one tdata path per line.
+    Empty lines and lines starting with '#' are ignored.
+    """
+    with open(manifest_path, "r", encoding="utf8") as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+def collect_tdata_paths(
+    paths: Iterable[str] = (),
+    patterns: Iterable[str] = (),
+    manifest: str = None,
+    roots: Iterable[str] = (),
+    discovery: TdataDiscovery = None,
+) -> List[str]:
+    """
+    Builds the list of tdata paths to read: explicit paths first, then
+    the matches of every glob pattern (sorted), then the manifest entries,
+    then the tdata folders found under roots.
+    """
+    collected = list(paths)
+
+    for pattern in patterns:
+        collected.extend(sorted(glob.glob(pattern, recursive=True)))
+
+    if manifest is not None:
+        collected.extend(read_manifest(manifest))
+
+    roots = list(roots)
+    if roots:
+        discovery = discovery or TdataDiscovery()
+        collected.extend(discovery.find(roots))
+
+    return collected
+
+
+def read_tdata(
+    path: str,
+    passcode: str = None,
+    key_cache: DerivedKeyCache = None,
+    with_settings: bool = True,
+    with_stats: bool = False,
+    sweep_cache: SweepCache = None,
+    dedup: TdfDedupCache = None,
+    limits: ParseLimits = None,
+    listing: bool = False,
+) -> BatchResult:
+    """
+    With dedup, BatchResult.dedup holds the lookups of this directory.
+    With limits, the directory is parsed within parse_limits(limits).
+    With listing, the directory is read through a ListingTdataFileSystem
+    (the sweep cache reads through its own file system).
+    """
+    result = BatchResult()
+    result.path = path
+
+    if dedup is not None:
+        dedup_before = dedup.stats.copy()
+
+    with parse_limits(limits) if limits is not None else nullcontext():
+        if sweep_cache is not None:
+            result.parsed_tdata, result.error = sweep_cache.read(
+                path, passcode, key_cache, with_settings, with_stats, dedup=dedup
+            )
+        else:
+            try:
+                io = ListingTdataFileSystem(path) if listing else path
+                reader = TdataReader(io, key_cache=key_cache, dedup=dedup)
+                result.parsed_tdata = reader.read(passcode, with_settings, with_stats)
+            except Exception as exc:
+                result.error = f"{type(exc).__name__}: {exc}"
+
+    if dedup is not None:
+        result.dedup = dedup.stats.since(dedup_before)
+
+    return result
+
+
+# Dedup cache of a worker process, shared by all directories it reads.
+_worker_dedup: Optional[TdfDedupCache] = None
+
+
+def _init_worker(dedup: bool):
+    global _worker_dedup
+
+    if dedup:
+        _worker_dedup = TdfDedupCache()
+
+
+def _read_tdata_in_worker(path: str, **kwargs) -> BatchResult:
+    return read_tdata(path, dedup=_worker_dedup, **kwargs)
+
+
+class BatchReader:
+    def __init__(
+        self,
+        workers: int = None,
+        chunksize: int = 1,
+        key_cache: DerivedKeyCache = None,
+        sweep_cache: SweepCache = None,
+        dedup: bool = False,
+        limits: ParseLimits = None,
+        listing: bool = False,
+    ):
+        """
+        workers is the number of worker processes, defaults to the number of CPUs.
+        With workers = 1 the directories are read in the current process.
+        key_cache and sweep_cache are shared by all workers.
+        With dedup, byte-identical TDF files are decrypted once per run,
+        or once per worker process when there are several.
+        With limits, every directory is parsed in strict mode, see parse_limits.
+        With listing, directories are read through ListingTdataFileSystem.
+        """
+        self._workers = workers
+        self._chunksize = chunksize
+        self._key_cache = key_cache
+        self._sweep_cache = sweep_cache
+        self._dedup = dedup
+        self._limits = limits
+        self._listing = listing
+
+    def read(
+        self,
+        paths: Iterable[str],
+        passcode: str = None,
+        with_settings: bool = True,
+        with_stats: bool = False,
+    ) -> Iterator[BatchResult]:
+        """
+        Reads every tdata directory and yields the results in input order.
+        A failure in one directory is reported in its BatchResult.error
+        and does not abort the run.
+        """
+        kwargs = dict(
+            passcode=passcode,
+            key_cache=self._key_cache,
+            with_settings=with_settings,
+            with_stats=with_stats,
+            sweep_cache=self._sweep_cache,
+            limits=self._limits,
+            listing=self._listing,
+        )
+
+        if self._workers == 1:
+            dedup = TdfDedupCache() if self._dedup else None
+            yield from map(partial(read_tdata, dedup=dedup, **kwargs), paths)
+            return
+
+        read = partial(_read_tdata_in_worker, **kwargs)
+
+        with ProcessPoolExecutor(
+            max_workers=self._workers,
+            initializer=_init_worker,
+            initargs=(self._dedup,),
+        ) as executor:
+            yield from executor.map(read, paths, chunksize=self._chunksize)
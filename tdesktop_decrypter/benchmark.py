@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from io import BytesIO
+from typing import Any, Callable, Dict, List
+
+from tdesktop_decrypter.tdf import parse_raw_tdf
+from tdesktop_decrypter.crypto import create_local_key, decrypt_local
+from tdesktop_decrypter.qt import QtCursor, read_qt_int32, read_qt_byte_array
+from tdesktop_decrypter.file_io import TdataFileSystem
+from tdesktop_decrypter.settings import index_settings_blocks
+from tdesktop_decrypter.storage import read_key_data_tdf, decrypt_settings_tdf
+from tdesktop_decrypter.decrypter import TdataReader
+from tdesktop_decrypter.corpus import generate_corpus
+
+
+def measure(func: Callable[[], Any], repeat: int = 1) -> float:
+    """
+    Returns the best wall time of repeat runs of func.
+    """
+    best = None
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def _legacy_read_int32(data: BytesIO) -> int:
+    # The BytesIO reader QtCursor replaced.
+    b = data.read(4)
+    if len(b) != 4:
+        raise StopIteration()
+
+    return int.from_bytes(b, "big", signed=True)
+
+
+def _legacy_read_byte_array(data: BytesIO) -> bytes:
+    length = _legacy_read_int32(data)
+    if length <= 0:
+        return b""
+
+    b = data.read(length)
+    if len(b) != length:
+        raise StopIteration()
+
+    return b
+
+
+def bench_qt(args) -> Dict[str, Any]:
+    """
+    Decoding of int32 fields and byte arrays with the legacy BytesIO readers,
+    the read_qt_* wrappers over QtCursor and QtCursor bulk reads.
+    """
+    count = args.count or 100000
+
+    ints = b"".join(i.to_bytes(4, "big") for i in range(count))
+    arrays = b"".join(len(b"abcdefgh").to_bytes(4, "big") + b"abcdefgh" for _ in range(count))
+
+    def legacy():
+        data = BytesIO(ints)
+        int_values = [_legacy_read_int32(data) for _ in range(count)]
+        data = BytesIO(arrays)
+        array_values = [_legacy_read_byte_array(data) for _ in range(count)]
+        return int_values, array_values
+
+    def wrappers():
+        data = QtCursor(ints)
+        int_values = [read_qt_int32(data) for _ in range(count)]
+        data = QtCursor(arrays)
+        array_values = [read_qt_byte_array(data) for _ in range(count)]
+        return int_values, array_values
+
+    def bulk():
+        int_values = list(QtCursor(ints).read_int32s(count))
+        data = QtCursor(arrays)
+        array_values = [data.read_byte_array() for _ in range(count)]
+        return int_values, array_values
+
+    if not legacy() == wrappers() == bulk():
+        raise AssertionError("QtCursor output differs from the legacy readers")
+
+    results = {"count": count}
+
+    for name, func in (("legacy", legacy), ("wrappers", wrappers), ("bulk", bulk)):
+        elapsed = measure(func, args.repeat)
+        results[name] = {
+            "seconds": elapsed,
+            "values_per_second": 2 * count / elapsed,
+        }
+
+    return results
+
+
+def _bench_stages(paths: List[str], passcode: str, repeat: int) -> Dict[str, float]:
+    passcode = passcode.encode()
+    folders = []
+
+    for path in paths:
+        io = TdataFileSystem(path)
+        reader = TdataReader(io)
+        files = sorted(os.listdir(path))
+        key_data_tdf = reader.read_key_data_tdf()
+        salt, key_encrypted, info_encrypted = read_key_data_tdf(key_data_tdf)
+        passcode_key = create_local_key(passcode, salt)
+        local_key = bytes(decrypt_local(key_encrypted, passcode_key))
+        encrypted = [info_encrypted] + [
+            QtCursor(parse_raw_tdf(io.read_file(name)).encrypted_data).read_byte_array_view()
+            for name in files
+            if not name.startswith(("key_", "settings"))
+        ]
+        folders.append(
+            (io, files, salt, local_key, encrypted, io.read_tdf_file("settings"))
+        )
+
+    def read_file():
+        for io, files, *_ in folders:
+            for name in files:
+                io.read_file(name)
+
+    raw = [[folder[0].read_file(name) for name in folder[1]] for folder in folders]
+
+    def parse():
+        for datas in raw:
+            for data in datas:
+                parse_raw_tdf(data)
+
+    def local_key():
+        for _, _, salt, *_ in folders:
+            create_local_key(passcode, salt)
+
+    def decrypt():
+        for _, _, _, key, encrypted, _ in folders:
+            for data in encrypted:
+                decrypt_local(data, key)
+
+    def settings():
+        for *_, settings_tdf in folders:
+            settings_decrypted = decrypt_settings_tdf(settings_tdf)
+            index = index_settings_blocks(settings_tdf.version, QtCursor(settings_decrypted))
+            dict(index)
+
+    def read():
+        for path in paths:
+            TdataReader(path).read(passcode.decode())
+
+    return {
+        name: measure(func, repeat) / len(paths)
+        for name, func in (
+            ("read_file", read_file),
+            ("parse_raw_tdf", parse),
+            ("create_local_key", local_key),
+            ("decrypt_local", decrypt),
+            ("settings", settings),
+            ("read", read),
+        )
+    }
+
+
+def bench_suite(args) -> Dict[str, Any]:
+    """
+    Per-folder wall time of every reading stage and of the end-to-end
+    TdataReader.read over a synthetic corpus, see tdesktop_decrypter.corpus.
+    """
+    count = args.count or 20
+
+    results = {
+        "count": count,
+        "accounts": args.accounts,
+        "passcode": bool(args.passcode),
+        "dc_options": args.dc_options,
+        "application_settings_size": args.application_settings_size,
+    }
+
+    with tempfile.TemporaryDirectory() as root:
+        paths = generate_corpus(
+            root,
+            count,
+            accounts=args.accounts,
+            passcode=args.passcode,
+            dc_options=args.dc_options,
+            application_settings_size=args.application_settings_size,
+        )
+        results["seconds_per_folder"] = _bench_stages(paths, args.passcode, args.repeat)
+
+    return results
+
+
+def compare_results(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float
+) -> List[str]:
+    """
+    Returns the stages which are slower than in the baseline by more than threshold (0.1 is 10%).
+    Only benchmarks and stages present in both are compared.
+    """
+    regressions = []
+
+    for name, result in results.items():
+        stages = result.get("seconds_per_folder", {})
+        baseline_stages = baseline.get(name, {}).get("seconds_per_folder", {})
+
+        for stage, seconds in stages.items():
+            if stage not in baseline_stages:
+                continue
+
+            ratio = seconds / baseline_stages[stage]
+            if ratio > 1 + threshold:
+                regressions.append(f"{name}.{stage}: {ratio:.2f}x baseline")
+
+    return regressions
+
+
+BENCHMARKS = {
+    "qt": bench_qt,
+    "suite": bench_suite,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tdesktop-decrypter benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS), help="Benchmark to run")
+    parser.add_argument(
+        "--count", type=int, default=None, help="Number of items (per-benchmark default)"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions, best is kept")
+    parser.add_argument(
+        "--accounts", type=int, default=1, help="Accounts per generated folder (suite)"
+    )
+    parser.add_argument(
+        "--passcode", "-p", type=str, default="", help="Passcode of generated folders (suite)"
+    )
+    parser.add_argument(
+        "--dc_options", type=int, default=10, help="DC options in generated settings (suite)"
+    )
+    parser.add_argument(
+        "--application_settings_size",
+        type=int,
+        default=1024,
+        help="Size of the generated dbiApplicationSettings block (suite)",
+    )
+    parser.add_argument("--output", type=str, default=None, help="Write results to a file")
+    parser.add_argument(
+        "--baseline", type=str, default=None, help="Compare against stored results"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Allowed slowdown against the baseline, 0.1 is 10%%",
+    )
+    args = parser.parse_args()
+
+    results = {args.benchmark: BENCHMARKS[args.benchmark](args)}
+    print(json.dumps(results, indent=4))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare_results(results, baseline, args.threshold)
+
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
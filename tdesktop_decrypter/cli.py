@@ -1,16 +1,37 @@
+import os
 import sys
 import json
 import argparse
 
-from typing import Dict, Any, Optional
+from contextlib import nullcontext
+from typing import Dict, Any, Iterable, Iterator, Mapping, Optional, Union
 
 from .decrypter import (
     ParsedTdata,
+    ParsedTdataFolder,
+    SETTINGS_ERROR_KEY,
     TdataReader,
+    TdataFolderReader,
     ParsedAccount,
     SettingsBlock,
     NoKeyFileException,
 )
+from .batch import BatchReader, BatchResult, collect_tdata_paths
+from .key_cache import DerivedKeyCache, MemoryDerivedKeyCache
+from .file_io import ListingTdataFileSystem, TdataFileIo
+from .sweep_cache import SweepCache
+from .recovery import PasscodeRecovery, RecoveryProgress, read_wordlist
+from .archive_io import read_archive
+from .discovery import TdataDiscovery
+from .stats import ReadStats
+from .dedup import DedupStats
+from .crypto_backend import BACKENDS, BACKEND_ENV, set_backend
+from .sqlite_sink import SqliteSink
+from .key_index import AuthKeyIndex, parse_key_id
+from .qt import ParseLimits, parse_limits
+from .verify import TriageRecord, verify_archive, verify_tdata_dirs
+from .server import TdataServer
+from .json_output import display_setting_value, tdata_to_json
 
 
 def eprint(*args, **kwargs):
@@ -29,21 +50,7 @@ def display_accounts(accounts: Dict[int, ParsedAccount]):
             print(f"Key DC {dc_id}: {key.hex()}")
 
 
-def display_setting_value(setting: Any) -> str:
-    if isinstance(setting, bytes):
-        return setting.hex()
-
-    if isinstance(setting, dict):
-        return {k: display_setting_value(v) for k, v in setting.items()}
-
-    if isinstance(setting, list):
-        return [display_setting_value(v) for v in setting]
-
-    assert any(isinstance(setting, c) for c in (int, float, str))
-    return setting
-
-
-def display_settings(settings: Optional[Dict[SettingsBlock, Any]]):
+def display_settings(settings: Optional[Mapping[SettingsBlock, Any]]):
     if settings is None:
         print("No settings found.")
         return
@@ -52,44 +59,62 @@ def display_settings(settings: Optional[Dict[SettingsBlock, Any]]):
         print(f"{setting_block}: {display_setting_value(value)}")
 
 
+def display_stats(stats: ReadStats):
+    print("Stats:")
+
+    for stage, stage_stats in stats.stages.items():
+        print(
+            f"{stage}: {stage_stats.calls} calls, {stage_stats.bytes} bytes, "
+            f"{stage_stats.wall_time * 1000:.3f} ms wall, "
+            f"{stage_stats.cpu_time * 1000:.3f} ms CPU"
+        )
+
+
 def display_stdout(parsed_tdata: ParsedTdata, show_settings: bool):
     display_accounts(parsed_tdata.accounts)
 
     if show_settings:
         display_settings(parsed_tdata.settings)
 
+    if parsed_tdata.stats is not None:
+        display_stats(parsed_tdata.stats)
+
 
 def display_json(parsed_tdata: ParsedTdata):
-    accounts = [
-        {
-            "index": account.index,
-            "user_id": account.mtp_data.user_id,
-            "main_dc_id": account.mtp_data.current_dc_id,
-            "dc_auth_keys": {
-                dc_id: key.hex().lower() for dc_id, key in account.mtp_data.keys.items()
-            },
-        }
-        for account in parsed_tdata.accounts.values()
-    ]
-
-    if parsed_tdata.settings is None:
-        settings = None
-    else:
-        settings = {
-            str(k): display_setting_value(v) for k, v in parsed_tdata.settings.items()
-        }
+    print(json.dumps(tdata_to_json(parsed_tdata), indent=4))
 
-    obj = {
-        "accounts": accounts,
-        "settings": settings,
-    }
 
-    # Settings
-    print(json.dumps(obj, indent=4))
+def display_batch_stdout(results: Iterable[BatchResult], show_settings: bool):
+    for result in results:
+        print(f"Tdata {result.path}:")
+
+        if result.ok:
+            display_stdout(result.parsed_tdata, show_settings)
+        else:
+            print(f"Error: {result.error}")
+
+        print()
+
+
+def display_batch_json(results: Iterable[BatchResult]):
+    objs = []
+
+    for result in results:
+        obj = {"path": result.path, "error": result.error}
+
+        if result.ok:
+            obj.update(tdata_to_json(result.parsed_tdata))
+
+        objs.append(obj)
+
+    print(json.dumps(objs, indent=4))
+
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("tdata", type=str, help="Path to tdata/ directory")
+    parser.add_argument(
+        "tdata", type=str, nargs="*", help="Path to tdata/ directory (or several)"
+    )
     parser.add_argument(
         "--passcode", "-p", type=str, default=None, required=False, help="Passcode"
     )
@@ -99,16 +124,541 @@ def main():
         help="Show decrypted settings",
     )
     parser.add_argument("--json", "-j", action="store_true", help="Output JSON")
+    parser.add_argument(
+        "--sqlite",
+        type=str,
+        default=None,
+        help="Write the results into a SQLite database instead of printing them",
+    )
+    parser.add_argument(
+        "--all_datanames",
+        action="store_true",
+        help="Read every key_* file of the tdata/ directory, not only key_data",
+    )
+    parser.add_argument(
+        "--key_index",
+        type=str,
+        default=None,
+        help="SQLite index of auth key IDs, updated with the folders read",
+    )
+    parser.add_argument(
+        "--lookup_key_id",
+        type=parse_key_id,
+        action="append",
+        default=[],
+        help="Find the folders holding an auth key ID in --key_index"
+        " (decimal int64, or 0x and the 16 hex digits of the header bytes)",
+    )
+    parser.add_argument(
+        "--verify_only",
+        action="store_true",
+        help="Only check the integrity of the tdata/ folders, without decrypting them",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Bound the size of files, byte arrays and counts parsed (untrusted input)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Show call counts, bytes and time of every reading stage",
+    )
+    parser.add_argument(
+        "--glob",
+        type=str,
+        action="append",
+        default=[],
+        help="Glob pattern matching tdata/ directories (batch mode)",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="File with one tdata/ path per line (batch mode)",
+    )
+    parser.add_argument(
+        "--discover",
+        type=str,
+        action="append",
+        default=[],
+        help="Directory tree to search for tdata/ directories (batch mode)",
+    )
+    parser.add_argument(
+        "--discover_threads",
+        type=int,
+        default=1,
+        help="Number of threads scanning directories for --discover",
+    )
+    parser.add_argument(
+        "--follow_symlinks",
+        action="store_true",
+        help="Follow symlinks while searching for tdata/ directories",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes in batch mode (default: CPU count)",
+    )
+    parser.add_argument(
+        "--listing_io",
+        action="store_true",
+        help="List every directory once and map large files (network filesystems)",
+    )
+    parser.add_argument(
+        "--key_cache",
+        type=str,
+        default=None,
+        help="Directory of the persistent derived key cache",
+    )
+    parser.add_argument(
+        "--sweep_cache",
+        type=str,
+        default=None,
+        help="Directory of the persistent result cache of batch mode",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Decrypt byte-identical files once per run (batch mode)",
+    )
+    parser.add_argument(
+        "--crypto_backend",
+        type=str,
+        choices=sorted(BACKENDS),
+        default=None,
+        help="AES-IGE implementation (default: the fastest installed one)",
+    )
+    parser.add_argument(
+        "--serve",
+        type=str,
+        default=None,
+        metavar="SOCKET",
+        help="Serve decryption requests on a Unix socket, keeping caches warm",
+    )
+    parser.add_argument(
+        "--wordlist",
+        type=str,
+        default=None,
+        help="Recover the passcode from a wordlist (one candidate per line)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="Checkpoint file to resume an interrupted passcode recovery",
+    )
     args = parser.parse_args()
 
-    reader = TdataReader(args.tdata)
+    if args.crypto_backend is not None:
+        # Inherited by the worker processes.
+        os.environ[BACKEND_ENV] = args.crypto_backend
+        set_backend(args.crypto_backend)
 
-    try:
-        parsed_tdata = reader.read(args.passcode)
+    if args.serve is not None:
+        serve(args)
+        return
 
-        if args.json:
-            display_json(parsed_tdata)
+    if args.lookup_key_id:
+        if args.key_index is None:
+            parser.error("--lookup_key_id requires --key_index")
+
+        lookup_key_ids(args)
+        return
+
+    check_arguments(parser, args)
+
+    args.limits = ParseLimits() if args.strict else None
+
+    with parse_limits(args.limits) if args.strict else nullcontext():
+        if args.verify_only:
+            verify(parser, args)
+        elif is_archive(args):
+            read_archive_file(args)
+        elif not is_batch(args):
+            read_single(args)
         else:
-            display_stdout(parsed_tdata, args.show_settings)
+            read_batch(parser, args)
+
+
+def is_batch(args) -> bool:
+    return bool(
+        len(args.tdata) != 1 or args.glob or args.manifest is not None or args.discover
+    )
+
+
+def is_archive(args) -> bool:
+    return len(args.tdata) == 1 and os.path.isfile(args.tdata[0])
+
+
+def check_arguments(parser: argparse.ArgumentParser, args):
+    """
+    Rejects the flags the selected mode would silently ignore.
+    """
+    if args.all_datanames:
+        if is_batch(args) or is_archive(args):
+            parser.error("--all_datanames reads a single tdata/ directory")
+
+        for flag, value in (
+            ("--sqlite", args.sqlite),
+            ("--key_index", args.key_index),
+            ("--wordlist", args.wordlist),
+        ):
+            if value is not None:
+                parser.error(f"--all_datanames cannot be combined with {flag}")
+
+        if args.verify_only:
+            parser.error("--all_datanames cannot be combined with --verify_only")
+
+    if is_archive(args):
+        # Archives are read sequentially with a single open, see read_archive.
+        for flag, used in (
+            ("--glob", args.glob),
+            ("--manifest", args.manifest is not None),
+            ("--discover", args.discover),
+            ("--dedup", args.dedup),
+            ("--sweep_cache", args.sweep_cache is not None),
+            ("--workers", args.workers is not None),
+            ("--listing_io", args.listing_io),
+        ):
+            if used:
+                parser.error(f"{flag} cannot be used with an archive")
+
+    if args.verify_only:
+        # Triage neither decrypts nor stores the folders.
+        for flag, used in (
+            ("--sqlite", args.sqlite is not None),
+            ("--key_index", args.key_index is not None),
+            ("--stats", args.stats),
+            ("--dedup", args.dedup),
+            ("--sweep_cache", args.sweep_cache is not None),
+        ):
+            if used:
+                parser.error(f"{flag} cannot be combined with --verify_only")
+    elif not is_batch(args) and not is_archive(args):
+        # Both caches pay off across the folders of a batch only.
+        for flag, used in (
+            ("--dedup", args.dedup),
+            ("--sweep_cache", args.sweep_cache is not None),
+        ):
+            if used:
+                parser.error(f"{flag} requires batch mode (several tdata/ directories)")
+
+    if args.wordlist is not None:
+        if is_batch(args) or is_archive(args) or args.verify_only:
+            parser.error("--wordlist recovers the passcode of a single tdata/ directory")
+    elif args.checkpoint is not None:
+        parser.error("--checkpoint requires --wordlist")
+
+
+def with_settings(args) -> bool:
+    # Settings are decrypted only when they are displayed or stored.
+    return args.show_settings or args.json or args.sqlite is not None
+
+
+def create_file_io(args) -> Union[str, TdataFileIo]:
+    if args.listing_io:
+        return ListingTdataFileSystem(args.tdata[0])
+
+    return args.tdata[0]
+
+
+def create_key_cache(args) -> Optional[DerivedKeyCache]:
+    if args.key_cache is None:
+        return None
+
+    return DerivedKeyCache(args.key_cache)
+
+
+def create_sweep_cache(args) -> Optional[SweepCache]:
+    if args.sweep_cache is None:
+        return None
+
+    return SweepCache(args.sweep_cache)
+
+
+def display_recovery_progress(progress: RecoveryProgress):
+    eprint(
+        f"Tried {progress.tried} passcodes, {progress.rate:.1f} passcodes/s"
+    )
+
+
+def recover_passcode(
+    reader: TdataReader, key_cache: DerivedKeyCache, args
+) -> Optional[str]:
+    """
+    The passcode key derived by the recovery is stored in key_cache,
+    so reading the folder does not derive it again.
+    """
+    recovery = PasscodeRecovery(
+        reader.read_key_data_tdf(),
+        workers=args.workers,
+        checkpoint_path=args.checkpoint,
+        progress=display_recovery_progress,
+    )
+
+    passcode = recovery.run(read_wordlist(args.wordlist))
+    if passcode is None:
+        return None
+
+    key_cache.put_local_key(passcode, recovery.salt, recovery.passcode_key)
+    return passcode.decode()
+
+
+def display_folder_stdout(parsed_folder: ParsedTdataFolder, show_settings: bool):
+    for dataname, parsed_tdata in parsed_folder.datanames.items():
+        print(f"Dataname {dataname}:")
+        display_accounts(parsed_tdata.accounts)
+
+        if parsed_tdata.stats is not None:
+            display_stats(parsed_tdata.stats)
+
+        print()
+
+    for dataname, error in parsed_folder.errors.items():
+        if dataname == SETTINGS_ERROR_KEY:
+            print(f"Settings: error: {error}")
+        else:
+            print(f"Dataname {dataname}: error: {error}")
+
+    if show_settings:
+        display_settings(parsed_folder.settings)
+
+
+def display_folder_json(parsed_folder: ParsedTdataFolder):
+    obj = {
+        "datanames": {
+            dataname: tdata_to_json(parsed_tdata)
+            for dataname, parsed_tdata in parsed_folder.datanames.items()
+        },
+        "errors": parsed_folder.errors,
+    }
+    print(json.dumps(obj, indent=4))
+
+
+def read_all_datanames(args):
+    reader = TdataFolderReader(
+        create_file_io(args), create_key_cache(args), workers=args.workers
+    )
+
+    try:
+        parsed_folder = reader.read(args.passcode, with_settings(args), args.stats)
+    except NoKeyFileException:
+        eprint("No key file was found. Is the tdata path correct?")
+        return
+
+    if args.json:
+        display_folder_json(parsed_folder)
+    else:
+        display_folder_stdout(parsed_folder, args.show_settings)
+
+
+def read_single(args):
+    if args.all_datanames:
+        read_all_datanames(args)
+        return
+
+    key_cache = create_key_cache(args)
+    if key_cache is None and args.wordlist is not None:
+        key_cache = MemoryDerivedKeyCache()
+
+    reader = TdataReader(create_file_io(args), key_cache=key_cache)
+
+    try:
+        if args.wordlist is not None:
+            args.passcode = recover_passcode(reader, key_cache, args)
+
+            if args.passcode is None:
+                eprint("Passcode was not found in the wordlist.")
+                return
+
+            eprint(f"Passcode found: {args.passcode}")
+
+        parsed_tdata = reader.read(args.passcode, with_settings(args), args.stats)
     except NoKeyFileException as exc:
         eprint("No key file was found. Is the tdata path correct?")
+        return
+
+    if args.sqlite is not None or args.key_index is not None:
+        store_single_result(args, parsed_tdata)
+
+    if args.sqlite is not None:
+        return
+
+    if args.json:
+        display_json(parsed_tdata)
+    else:
+        display_stdout(parsed_tdata, args.show_settings)
+
+
+def store_single_result(args, parsed_tdata: ParsedTdata):
+    # The sinks take batch results, a single folder is a batch of one.
+    result = BatchResult()
+    result.path = args.tdata[0]
+    result.parsed_tdata = parsed_tdata
+
+    if args.key_index is not None:
+        with AuthKeyIndex(args.key_index) as key_index:
+            key_index.write(result)
+
+    if args.sqlite is not None:
+        with SqliteSink(args.sqlite) as sink:
+            count = sink.write_all([result])
+
+        eprint(f"Wrote {count} tdata folders to {args.sqlite}")
+
+
+def display_dedup_stats(stats: DedupStats):
+    for kind, lookups in stats.lookups.items():
+        eprint(
+            f"Dedup {kind}: {stats.hits.get(kind, 0)}/{lookups} hits "
+            f"({stats.hit_rate(kind):.1%})"
+        )
+
+
+def collect_dedup_stats(
+    results: Iterable[BatchResult], stats: DedupStats
+) -> Iterator[BatchResult]:
+    for result in results:
+        if result.dedup is not None:
+            stats.merge(result.dedup)
+
+        yield result
+
+
+def index_auth_keys(
+    results: Iterable[BatchResult], key_index: AuthKeyIndex
+) -> Iterator[BatchResult]:
+    for result in results:
+        key_index.write(result)
+        yield result
+
+
+def lookup_key_ids(args):
+    with AuthKeyIndex(args.key_index) as key_index:
+        for key_id in args.lookup_key_id:
+            locations = key_index.lookup(key_id)
+
+            if not locations:
+                print(f"Key ID {key_id}: not found")
+
+            for location in locations:
+                destroy = " (to destroy)" if location.to_destroy else ""
+                print(
+                    f"Key ID {key_id}: {location.path}, account {location.account_index}, "
+                    f"DC {location.dc_id}{destroy}"
+                )
+
+
+def display_results(results: Iterable[BatchResult], args):
+    dedup_stats = DedupStats()
+    results = collect_dedup_stats(results, dedup_stats)
+
+    if args.key_index is not None:
+        with AuthKeyIndex(args.key_index) as key_index:
+            display_results_to(index_auth_keys(results, key_index), args)
+    else:
+        display_results_to(results, args)
+
+    if dedup_stats.lookups:
+        display_dedup_stats(dedup_stats)
+
+
+def display_results_to(results: Iterable[BatchResult], args):
+    if args.sqlite is not None:
+        with SqliteSink(args.sqlite) as sink:
+            count = sink.write_all(results)
+
+        eprint(f"Wrote {count} tdata folders to {args.sqlite}")
+    elif args.json:
+        display_batch_json(results)
+    else:
+        display_batch_stdout(results, args.show_settings)
+
+
+def read_archive_file(args):
+    results = read_archive(
+        args.tdata[0],
+        args.passcode,
+        create_key_cache(args),
+        with_settings(args),
+        args.stats,
+    )
+    display_results(results, args)
+
+
+def serve(args):
+    server = TdataServer(args.serve, args.workers, create_key_cache(args))
+    eprint(f"Serving on {args.serve}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def display_triage_stdout(records: Iterable[TriageRecord]):
+    for record in records:
+        if record.error is not None:
+            print(f"{record.path}: error: {record.error}")
+            continue
+
+        if record.passcode_set is None:
+            passcode = "passcode unknown"
+        elif record.passcode_set:
+            passcode = "passcode set"
+        else:
+            passcode = f"no passcode, {len(record.accounts)} accounts"
+
+        if record.settings_error is not None:
+            settings = f"settings error: {record.settings_error}"
+        elif record.has_settings:
+            settings = "settings"
+        else:
+            settings = "no settings"
+
+        print(f"{record.path}: key_data version {record.version}, {settings}, {passcode}")
+
+
+def verify(parser: argparse.ArgumentParser, args):
+    if len(args.tdata) == 1 and os.path.isfile(args.tdata[0]):
+        records = verify_archive(args.tdata[0])
+    else:
+        discovery = TdataDiscovery(
+            follow_symlinks=args.follow_symlinks, threads=args.discover_threads
+        )
+        paths = collect_tdata_paths(
+            args.tdata, args.glob, args.manifest, args.discover, discovery
+        )
+        if not paths:
+            parser.error("no tdata paths given")
+
+        records = verify_tdata_dirs(paths, args.workers)
+
+    if args.json:
+        print(json.dumps([record.to_json() for record in records], indent=4))
+    else:
+        display_triage_stdout(records)
+
+
+def read_batch(parser: argparse.ArgumentParser, args):
+    discovery = TdataDiscovery(
+        follow_symlinks=args.follow_symlinks, threads=args.discover_threads
+    )
+    paths = collect_tdata_paths(
+        args.tdata, args.glob, args.manifest, args.discover, discovery
+    )
+    if not paths:
+        parser.error("no tdata paths given")
+
+    reader = BatchReader(
+        args.workers,
+        key_cache=create_key_cache(args),
+        sweep_cache=create_sweep_cache(args),
+        dedup=args.dedup,
+        limits=args.limits,
+        listing=args.listing_io,
+    )
+    results = reader.read(paths, args.passcode, with_settings(args), args.stats)
+    display_results(results, args)
@@ -0,0 +1,75 @@
+"""
+Thin client of tdesktop_decrypter.server: sends one request and prints the
+response lines. It imports nothing but the standard library modules it needs,
+so it starts much faster than the full CLI.
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+
+from typing import Any, Dict, Iterator, List
+
+
+def request(
+    socket_path: str, paths: List[str], **fields: Any
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the response of every path, in order.
+    fields are the optional request fields: passcode, settings, dataname.
+    """
+    if not paths:
+        raise ValueError("no tdata paths given")
+
+    message = {"id": 0, "paths": paths}
+    message.update(fields)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+
+        with sock.makefile("rwb") as f:
+            f.write(json.dumps(message).encode() + b"\n")
+            f.flush()
+
+            for _ in paths:
+                line = f.readline()
+                if not line:
+                    raise ConnectionError("server closed the connection")
+
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tdesktop-decrypter server client")
+    parser.add_argument("socket", type=str, help="Unix socket of the server")
+    parser.add_argument("tdata", type=str, nargs="+", help="Path to tdata/ directory")
+    parser.add_argument(
+        "--passcode", "-p", type=str, default=None, required=False, help="Passcode"
+    )
+    parser.add_argument(
+        "--show_settings",
+        action="store_true",
+        help="Include decrypted settings",
+    )
+    args = parser.parse_args()
+
+    fields = {"settings": args.show_settings}
+    if args.passcode is not None:
+        fields["passcode"] = args.passcode
+
+    failed = False
+
+    # Paths are sent absolute: the server does not share the working directory.
+    paths = [os.path.abspath(path) for path in args.tdata]
+
+    for response in request(args.socket, paths, **fields):
+        failed = failed or response.get("error") is not None
+        print(json.dumps(response))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
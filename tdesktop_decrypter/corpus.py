@@ -0,0 +1,273 @@
+"""
+Generator of synthetic encrypted tdata/ folders for benchmarks.
+"""
+
+import os
+import random
+import argparse
+
+from typing import Dict, List
+
+from tdesktop_decrypter.tdf import serialize_tdf
+from tdesktop_decrypter.crypto import (
+    create_local_key,
+    create_legacy_local_key,
+    encrypt_local,
+)
+from tdesktop_decrypter.qt import (
+    write_qt_int32,
+    write_qt_uint64,
+    write_qt_byte_array,
+    write_qt_utf8,
+)
+from tdesktop_decrypter.settings import SettingsBlock
+from tdesktop_decrypter.decrypter import compose_account_name, compute_data_name_key
+
+DEFAULT_VERSION = 4008004
+
+SALT_SIZE = 32
+LOCAL_KEY_SIZE = 256
+AUTH_KEY_SIZE = 256
+
+
+def _block(block_id: SettingsBlock, data: bytes) -> bytes:
+    return write_qt_int32(block_id.value) + data
+
+
+def _write_tdf(path: str, version: int, data: bytes):
+    with open(path, "wb") as f:
+        f.write(serialize_tdf(version, data))
+
+
+def build_dc_options(count: int) -> bytes:
+    data = write_qt_int32(-2) + write_qt_int32(count)
+
+    for i in range(count):
+        data += write_qt_int32(i % 5 + 1)
+        data += write_qt_int32(i % 4)
+        data += write_qt_int32(443)
+        data += write_qt_byte_array(f"149.154.{i // 256}.{i % 256}".encode())
+        data += write_qt_byte_array(b"")
+
+    data += write_qt_int32(1)
+    data += write_qt_int32(1)
+    data += write_qt_byte_array(os.urandom(256))
+    data += write_qt_byte_array(b"\x01\x00\x01")
+
+    return data
+
+
+def build_fallback_config(dc_options: int) -> bytes:
+    data = write_qt_int32(1) + write_qt_int32(0)
+    data += write_qt_byte_array(build_dc_options(dc_options))
+    data += b"".join(write_qt_int32(100 + i) for i in range(19))
+    data += write_qt_utf8("t.me")
+    data += b"".join(write_qt_int32(200 + i) for i in range(6))
+    data += write_qt_utf8("tapv3.stel.com")
+    data += b"".join(write_qt_int32(i) for i in (1, 0, 1024))
+    data += write_qt_utf8("x")
+    data += write_qt_uint64(0)
+    return data
+
+
+def build_settings(dc_options: int, application_settings_size: int) -> bytes:
+    return b"".join(
+        [
+            _block(SettingsBlock.dbiAutoStart, write_qt_int32(1)),
+            _block(SettingsBlock.dbiScalePercent, write_qt_int32(100)),
+            _block(
+                SettingsBlock.dbiThemeKey,
+                write_qt_uint64(1) + write_qt_uint64(2) + write_qt_int32(0),
+            ),
+            _block(
+                SettingsBlock.dbiFallbackProductionConfig,
+                write_qt_byte_array(build_fallback_config(dc_options)),
+            ),
+            _block(SettingsBlock.dbiDialogLastPath, write_qt_utf8("/home/user")),
+            _block(
+                SettingsBlock.dbiApplicationSettings,
+                write_qt_byte_array(os.urandom(application_settings_size)),
+            ),
+        ]
+    )
+
+
+def build_mtp_authorization(user_id: int, main_dc_id: int, dc_ids: List[int]) -> bytes:
+    def keys(ids: List[int]) -> bytes:
+        return write_qt_int32(len(ids)) + b"".join(
+            write_qt_int32(dc_id) + os.urandom(AUTH_KEY_SIZE) for dc_id in ids
+        )
+
+    return (
+        write_qt_int32(-1)
+        + write_qt_int32(-1)
+        + write_qt_uint64(user_id)
+        + write_qt_int32(main_dc_id)
+        + keys(dc_ids)
+        + keys([])
+    )
+
+
+def generate_tdata(
+    path: str,
+    accounts: int = 1,
+    passcode: str = "",
+    dc_options: int = 10,
+    application_settings_size: int = 1024,
+    dataname: str = "data",
+    version: int = DEFAULT_VERSION,
+    account_files: int = 0,
+    account_file_size: int = 4096,
+) -> Dict[int, int]:
+    """
+    Writes an encrypted tdata/ folder readable by TdataReader.
+    With account_files, every account also gets an account folder with
+    a map file and account_files keyed files of account_file_size random bytes.
+    Returns the generated user ID of every account index.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    # settings
+    salt = os.urandom(SALT_SIZE)
+    settings_key = create_legacy_local_key(b"", salt)
+    settings = build_settings(dc_options, application_settings_size)
+    _write_tdf(
+        os.path.join(path, "settingss"),
+        version,
+        write_qt_byte_array(salt)
+        + write_qt_byte_array(encrypt_local(settings, settings_key)),
+    )
+
+    # key_data
+    salt = os.urandom(SALT_SIZE)
+    local_key = os.urandom(LOCAL_KEY_SIZE)
+    passcode_key = create_local_key(passcode.encode(), salt)
+    indexes = list(range(accounts))
+    info = (
+        write_qt_int32(len(indexes))
+        + b"".join(write_qt_int32(index) for index in indexes)
+        + write_qt_int32(0)
+    )
+    _write_tdf(
+        os.path.join(path, f"key_{dataname}s"),
+        version,
+        write_qt_byte_array(salt)
+        + write_qt_byte_array(encrypt_local(local_key, passcode_key))
+        + write_qt_byte_array(encrypt_local(info, local_key)),
+    )
+
+    # accounts
+    user_ids = {}
+
+    for index in indexes:
+        user_ids[index] = random.getrandbits(40)
+        main_dc_id = random.randint(1, 5)
+
+        mtp_authorization = build_mtp_authorization(
+            user_ids[index], main_dc_id, sorted({main_dc_id, 2, 4})
+        )
+        mtp_data = _block(
+            SettingsBlock.dbiMtpAuthorization, write_qt_byte_array(mtp_authorization)
+        )
+
+        name = compute_data_name_key(compose_account_name(dataname, index))
+        _write_tdf(
+            os.path.join(path, name + "s"),
+            version,
+            write_qt_byte_array(encrypt_local(mtp_data, local_key)),
+        )
+
+        if account_files:
+            generate_account_folder(
+                os.path.join(path, name),
+                local_key,
+                account_files,
+                account_file_size,
+                version,
+            )
+
+    return user_ids
+
+
+def generate_account_folder(
+    path: str, local_key: bytes, count: int, size: int, version: int
+):
+    os.makedirs(path, exist_ok=True)
+
+    file_keys = [os.urandom(8).hex().upper() for _ in range(count)]
+
+    map_data = write_qt_int32(len(file_keys)) + b"".join(
+        write_qt_utf8(file_key) for file_key in file_keys
+    )
+    _write_tdf(
+        os.path.join(path, "maps"),
+        version,
+        write_qt_byte_array(b"")
+        + write_qt_byte_array(b"")
+        + write_qt_byte_array(encrypt_local(map_data, local_key)),
+    )
+
+    for file_key in file_keys:
+        _write_tdf(
+            os.path.join(path, file_key + "s"),
+            version,
+            write_qt_byte_array(encrypt_local(os.urandom(size), local_key)),
+        )
+
+
+def generate_corpus(root: str, count: int, **kwargs) -> List[str]:
+    """
+    Writes count tdata/ folders under root, kwargs are passed to generate_tdata.
+    Returns their paths.
+    """
+    paths = [os.path.join(root, f"{i:05}", "tdata") for i in range(count)]
+
+    for path in paths:
+        generate_tdata(path, **kwargs)
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic tdata/ folders")
+    parser.add_argument("root", type=str, help="Output directory")
+    parser.add_argument("--count", type=int, default=1, help="Number of tdata/ folders")
+    parser.add_argument("--accounts", type=int, default=1, help="Accounts per folder")
+    parser.add_argument("--passcode", "-p", type=str, default="", help="Passcode")
+    parser.add_argument(
+        "--dc_options", type=int, default=10, help="DC options in the settings"
+    )
+    parser.add_argument(
+        "--application_settings_size",
+        type=int,
+        default=1024,
+        help="Size of the dbiApplicationSettings block",
+    )
+    parser.add_argument(
+        "--account_files",
+        type=int,
+        default=0,
+        help="Keyed files in the folder of every account",
+    )
+    parser.add_argument(
+        "--account_file_size", type=int, default=4096, help="Size of keyed files"
+    )
+    args = parser.parse_args()
+
+    paths = generate_corpus(
+        args.root,
+        args.count,
+        accounts=args.accounts,
+        passcode=args.passcode,
+        dc_options=args.dc_options,
+        application_settings_size=args.application_settings_size,
+        account_files=args.account_files,
+        account_file_size=args.account_file_size,
+    )
+
+    for path in paths:
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,69 @@
-import hashlib
+import os
 
-import tgcrypto
+from typing import Iterable, Iterator
+
+from tdesktop_decrypter.stats import instrumented
+from tdesktop_decrypter.crypto_backend import get_backend
 
 LocalEncryptNoPwdIterCount = 4
 LocalEncryptIterCount = 400
 kStrongIterationsCount = 100000
 
+DEFAULT_STREAM_CHUNK_SIZE = 64 * 1024
+
 
 class CryptoException(Exception):
     pass
 
 
-def create_local_key(passcode: bytes, salt: bytes) -> bytes:
+def local_key_iterations(passcode: bytes) -> int:
     if passcode:
-        iterations = kStrongIterationsCount
+        return kStrongIterationsCount
     else:
-        iterations = 1
-
-    password = hashlib.sha512(salt + passcode + salt).digest()
-    return hashlib.pbkdf2_hmac("sha512", password, salt, iterations, 256)
+        return 1
 
 
-def create_legacy_local_key(passcode: bytes, salt: bytes) -> bytes:
+def legacy_local_key_iterations(passcode: bytes) -> int:
     if passcode:
-        iterations = LocalEncryptIterCount
+        return LocalEncryptIterCount
     else:
-        iterations = LocalEncryptNoPwdIterCount
+        return LocalEncryptNoPwdIterCount
+
+
+@instrumented("create_local_key")
+def create_local_key(passcode: bytes, salt: bytes) -> bytes:
+    iterations = local_key_iterations(passcode)
+
+    backend = get_backend()
+    password = backend.sha512(salt + passcode + salt)
+    return backend.pbkdf2_hmac("sha512", password, salt, iterations, 256)
 
-    return hashlib.pbkdf2_hmac("sha1", passcode, salt, iterations, 256)
+
+@instrumented("create_legacy_local_key")
+def create_legacy_local_key(passcode: bytes, salt: bytes) -> bytes:
+    iterations = legacy_local_key_iterations(passcode)
+    return get_backend().pbkdf2_hmac("sha1", passcode, salt, iterations, 256)
 
 
-def decrypt_local(encrypted_msg, local_key):
-    msg_key, encrypted_data = encrypted_msg[:16], encrypted_msg[16:]
+def auth_key_id(auth_key: bytes) -> int:
+    """
+    MTProto auth_key_id: the lower 64 bits of SHA1(auth_key),
+    as the signed little-endian int64 sent in the unencrypted message header.
+    """
+    return int.from_bytes(get_backend().sha1(auth_key)[-8:], "little", signed=True)
+
+
+def decrypt_local(encrypted_msg, local_key) -> memoryview:
+    """
+    encrypted_msg is any bytes-like object.
+    Returns a memoryview of the decrypted buffer without the length prefix and padding.
+    """
+    encrypted_msg = memoryview(encrypted_msg)
+    msg_key, encrypted_data = bytes(encrypted_msg[:16]), encrypted_msg[16:]
 
     decrypted = aes_decrypt_local(encrypted_data, msg_key, local_key)
 
-    if hashlib.sha1(decrypted).digest()[:16] != msg_key:
+    if get_backend().sha1(decrypted)[:16] != msg_key:
         raise CryptoException(
             "bad decrypt key, data not decrypted - incorrect password"
         )
@@ -44,12 +72,111 @@ def decrypt_local(encrypted_msg, local_key):
     if length > len(decrypted):
         raise CryptoException(f"corrupted data. wrong length: {length}")
 
-    return decrypted[4:length]
+    return memoryview(decrypted)[4:length]
+
+
+def decrypt_local_stream(
+    encrypted_chunks: Iterable,
+    local_key,
+    chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """
+    Streaming counterpart of decrypt_local. encrypted_chunks are consecutive
+    pieces of encrypted_msg of any size, decrypted chunk_size bytes at a time
+    (a multiple of 16) while the IGE state and SHA-1 are carried over.
+    Yields the plaintext without the length prefix and padding.
+    msg_key is checked after the last chunk: on CryptoException everything
+    yielded before must be discarded.
+    """
+    if chunk_size <= 0 or chunk_size % 16:
+        raise ValueError("chunk_size must be a positive multiple of 16")
+
+    sha1 = get_backend().new_sha1()
+    buffer = bytearray()
+    msg_key = aes_key = aes_iv = None
+    length = None
+    offset = 0
+
+    def decrypt_chunk(chunk: bytes) -> bytes:
+        nonlocal aes_iv, length, offset
+
+        decrypted = aes_decrypt_local_chunk(chunk, aes_key, aes_iv)
+        aes_iv = chunk[-16:] + decrypted[-16:]
+        sha1.update(decrypted)
+
+        if length is None:
+            length = int.from_bytes(decrypted[:4], "little")
+
+        start = offset
+        offset += len(decrypted)
+        return decrypted[max(4, start) - start : max(min(length, offset) - start, 0)]
+
+    for encrypted_chunk in encrypted_chunks:
+        buffer += encrypted_chunk
+
+        if msg_key is None:
+            if len(buffer) < 16:
+                continue
+
+            msg_key = bytes(buffer[:16])
+            del buffer[:16]
+            aes_key, aes_iv = prepare_aes_old_mtp(local_key, msg_key)
+
+        while len(buffer) >= chunk_size:
+            chunk = bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+
+            plaintext = decrypt_chunk(chunk)
+            if plaintext:
+                yield plaintext
+
+    if msg_key is None or len(buffer) % 16:
+        raise CryptoException("corrupted data. not a multiple of the block size")
+
+    if buffer:
+        plaintext = decrypt_chunk(bytes(buffer))
+        if plaintext:
+            yield plaintext
+
+    if sha1.digest()[:16] != msg_key:
+        raise CryptoException(
+            "bad decrypt key, data not decrypted - incorrect password"
+        )
+
+    if length is None or length > offset:
+        raise CryptoException(f"corrupted data. wrong length: {length}")
+
+
+def encrypt_local(data, local_key) -> bytes:
+    """
+    Inverse of decrypt_local: prepends the length and pads the data
+    to the AES block size with random bytes.
+    """
+    plain = (len(data) + 4).to_bytes(4, "little") + bytes(data)
+    plain += os.urandom(-len(plain) % 16)
+
+    msg_key = get_backend().sha1(plain)[:16]
+    return msg_key + aes_encrypt_local(plain, msg_key, local_key)
 
 
+def aes_encrypt_local(data, msg_key, local_key):
+    aes_key, aes_iv = prepare_aes_old_mtp(local_key, msg_key)
+    return get_backend().ige256_encrypt(data, aes_key, aes_iv)
+
+
+@instrumented(
+    "aes_decrypt_local", size=lambda result, encrypted_data, *_: len(encrypted_data)
+)
 def aes_decrypt_local(encrypted_data, msg_key, local_key):
     aes_key, aes_iv = prepare_aes_old_mtp(local_key, msg_key)
-    return tgcrypto.ige256_decrypt(encrypted_data, aes_key, aes_iv)
+    return get_backend().ige256_decrypt(encrypted_data, aes_key, aes_iv)
+
+
+@instrumented(
+    "aes_decrypt_local", size=lambda result, encrypted_data, *_: len(encrypted_data)
+)
+def aes_decrypt_local_chunk(encrypted_data, aes_key, aes_iv):
+    return get_backend().ige256_decrypt(encrypted_data, aes_key, aes_iv)
 
 
 def prepare_aes_old_mtp(local_key, msg_key, send=False):
@@ -63,10 +190,12 @@ def prepare_aes_old_mtp(local_key, msg_key, send=False):
     dataC = key_pos(x + 64, 32) + msg_key
     dataD = msg_key + key_pos(x + 96, 32)
 
-    sha1A = hashlib.sha1(dataA).digest()
-    sha1B = hashlib.sha1(dataB).digest()
-    sha1C = hashlib.sha1(dataC).digest()
-    sha1D = hashlib.sha1(dataD).digest()
+    sha1 = get_backend().sha1
+
+    sha1A = sha1(dataA)
+    sha1B = sha1(dataB)
+    sha1C = sha1(dataC)
+    sha1D = sha1(dataD)
 
     key = sha1A[:8] + sha1B[8:20] + sha1C[4:16]
     iv = sha1A[8:20] + sha1B[:8] + sha1C[16:20] + sha1D[:8]
@@ -0,0 +1,235 @@
+import os
+import time
+import hashlib
+
+from typing import Callable, Dict, List, Optional, Type, Union
+
+BACKEND_ENV = "TDESKTOP_DECRYPTER_CRYPTO_BACKEND"
+
+
+class CryptoBackendException(Exception):
+    pass
+
+
+class CryptoBackend:
+    """
+    AES-256-IGE and the hash primitives used by crypto.
+    Hashes and PBKDF2 come from hashlib (OpenSSL) unless a backend overrides them.
+    The IV of the IGE functions is 32 bytes: the previous ciphertext block
+    followed by the previous plaintext block, as in tgcrypto.
+    Constructors raise ImportError when the backend is not installed.
+    """
+
+    name: str = None
+
+    def ige256_encrypt(self, data, key: bytes, iv: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def ige256_decrypt(self, data, key: bytes, iv: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def sha1(self, data) -> bytes:
+        return hashlib.sha1(data).digest()
+
+    def new_sha1(self):
+        """
+        Incremental SHA-1 with the hashlib interface (update, digest).
+        """
+        return hashlib.sha1()
+
+    def sha512(self, data) -> bytes:
+        return hashlib.sha512(data).digest()
+
+    def pbkdf2_hmac(
+        self, hash_name: str, password: bytes, salt: bytes, iterations: int, dklen: int
+    ) -> bytes:
+        return hashlib.pbkdf2_hmac(hash_name, password, salt, iterations, dklen)
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class TgcryptoBackend(CryptoBackend):
+    name = "tgcrypto"
+
+    def __init__(self):
+        import tgcrypto
+
+        self.ige256_encrypt = tgcrypto.ige256_encrypt
+        self.ige256_decrypt = tgcrypto.ige256_decrypt
+
+
+class BlockCipherBackend(CryptoBackend):
+    """
+    IGE chaining over a single-block AES primitive working on 128-bit integers.
+    Every block depends on the previous one in both directions,
+    so the blocks go one by one through the same cipher context.
+    """
+
+    def _block_encryptor(self, key: bytes) -> Callable[[int], int]:
+        raise NotImplementedError()
+
+    def _block_decryptor(self, key: bytes) -> Callable[[int], int]:
+        raise NotImplementedError()
+
+    def ige256_encrypt(self, data, key: bytes, iv: bytes) -> bytes:
+        data = memoryview(data)
+        if len(data) % 16:
+            raise CryptoBackendException("data length must be a multiple of 16")
+
+        encrypt = self._block_encryptor(key)
+        c_prev = int.from_bytes(iv[:16], "big")
+        p_prev = int.from_bytes(iv[16:32], "big")
+        out = bytearray(len(data))
+
+        for i in range(0, len(data), 16):
+            p = int.from_bytes(data[i : i + 16], "big")
+            c = encrypt(p ^ c_prev) ^ p_prev
+            out[i : i + 16] = c.to_bytes(16, "big")
+            c_prev, p_prev = c, p
+
+        return bytes(out)
+
+    def ige256_decrypt(self, data, key: bytes, iv: bytes) -> bytes:
+        data = memoryview(data)
+        if len(data) % 16:
+            raise CryptoBackendException("data length must be a multiple of 16")
+
+        decrypt = self._block_decryptor(key)
+        c_prev = int.from_bytes(iv[:16], "big")
+        p_prev = int.from_bytes(iv[16:32], "big")
+        out = bytearray(len(data))
+
+        for i in range(0, len(data), 16):
+            c = int.from_bytes(data[i : i + 16], "big")
+            p = decrypt(c ^ p_prev) ^ c_prev
+            out[i : i + 16] = p.to_bytes(16, "big")
+            c_prev, p_prev = c, p
+
+        return bytes(out)
+
+
+class CryptographyBackend(BlockCipherBackend):
+    """
+    OpenSSL AES-ECB through the cryptography package.
+    """
+
+    name = "cryptography"
+
+    def __init__(self):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        self._cipher = lambda key: Cipher(algorithms.AES(key), modes.ECB())
+
+    def _block_encryptor(self, key: bytes) -> Callable[[int], int]:
+        update = self._cipher(key).encryptor().update
+        return lambda block: int.from_bytes(update(block.to_bytes(16, "big")), "big")
+
+    def _block_decryptor(self, key: bytes) -> Callable[[int], int]:
+        update = self._cipher(key).decryptor().update
+        return lambda block: int.from_bytes(update(block.to_bytes(16, "big")), "big")
+
+
+class PythonBackend(BlockCipherBackend):
+    """
+    Pure Python AES, always available and much slower than the others.
+    """
+
+    name = "python"
+
+    def _block_encryptor(self, key: bytes) -> Callable[[int], int]:
+        from tdesktop_decrypter.aes import encrypt_block, expand_key
+
+        rk = expand_key(key)
+        return lambda block: encrypt_block(block, rk)
+
+    def _block_decryptor(self, key: bytes) -> Callable[[int], int]:
+        from tdesktop_decrypter.aes import decrypt_block, expand_decryption_key
+
+        rk = expand_decryption_key(key)
+        return lambda block: decrypt_block(block, rk)
+
+
+BACKENDS: Dict[str, Type[CryptoBackend]] = {
+    backend.name: backend
+    for backend in (TgcryptoBackend, CryptographyBackend, PythonBackend)
+}
+
+
+def available_backends() -> List[CryptoBackend]:
+    backends = []
+
+    for backend_class in BACKENDS.values():
+        try:
+            backends.append(backend_class())
+        except ImportError:
+            pass
+
+    return backends
+
+
+def create_backend(name: str) -> CryptoBackend:
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise CryptoBackendException(
+            f"unknown crypto backend {name!r}, expected one of {sorted(BACKENDS)}"
+        ) from None
+
+    try:
+        return backend_class()
+    except ImportError as exc:
+        raise CryptoBackendException(f"crypto backend {name!r} is not installed") from exc
+
+
+def benchmark_backend(backend: CryptoBackend, size: int = 1024, repeat: int = 3) -> float:
+    """
+    Best time of an IGE decryption of size bytes, the size of a typical tdata file.
+    """
+    data = bytes(size)
+    key = bytes(range(32))
+    iv = bytes(range(32, 64))
+    best = None
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        backend.ige256_decrypt(data, key, iv)
+        elapsed = time.perf_counter() - started
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def select_fastest_backend() -> CryptoBackend:
+    return min(available_backends(), key=benchmark_backend)
+
+
+_backend: Optional[CryptoBackend] = None
+
+
+def get_backend() -> CryptoBackend:
+    """
+    The backend chosen with set_backend or the TDESKTOP_DECRYPTER_CRYPTO_BACKEND
+    environment variable, otherwise the fastest available one, measured on first use.
+    """
+    global _backend
+
+    if _backend is None:
+        name = os.environ.get(BACKEND_ENV)
+        _backend = create_backend(name) if name else select_fastest_backend()
+
+    return _backend
+
+
+def set_backend(backend: Union[str, CryptoBackend, None]):
+    """
+    backend is a backend name, a CryptoBackend, or None to select again on next use.
+    """
+    global _backend
+
+    if isinstance(backend, str):
+        backend = create_backend(backend)
+
+    _backend = backend
@@ -1,12 +1,21 @@
 import hashlib
 
-from typing import Tuple, List, Dict, Optional, Any
-
-from io import BytesIO
-
-from tdesktop_decrypter.qt import read_qt_int32, read_qt_uint64
-from tdesktop_decrypter.file_io import TdataFileIo, TdataFileSystem
-from tdesktop_decrypter.settings import SettingsBlock, read_settings_blocks
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Dict, Mapping, Optional, Any
+
+from tdesktop_decrypter.qt import QtCursor, as_qt_cursor, read_qt_int32, read_qt_uint64
+from tdesktop_decrypter.tdf import RawTdfFile
+from tdesktop_decrypter.file_io import TdataFileIo, TdataFileSystem, decrypt_encrypted_tdf
+from tdesktop_decrypter.key_cache import DerivedKeyCache
+from tdesktop_decrypter.dedup import TdfDedupCache
+from tdesktop_decrypter.stats import ReadStats, collect_stats
+from tdesktop_decrypter.crypto_backend import get_backend
+from tdesktop_decrypter.settings import (
+    SettingsBlock,
+    SettingsIndex,
+    index_settings_blocks,
+)
 from tdesktop_decrypter.storage import (
     decrypt_key_data_tdf,
     read_key_data_accounts,
@@ -50,7 +59,9 @@ class MtpData:
         return f"MtpData(user_id={self.user_id})"
 
 
-def read_mtp_authorization(data: BytesIO) -> MtpData:
+def read_mtp_authorization(data: QtCursor) -> MtpData:
+    data = as_qt_cursor(data)
+
     legacy_user_id = read_qt_int32(data)
     legacy_main_dc_id = read_qt_int32(data)
 
@@ -62,9 +73,10 @@ def read_mtp_authorization(data: BytesIO) -> MtpData:
         main_dc_id = legacy_main_dc_id
 
     def read_keys():
-        count = read_qt_int32(data)
+        # dc_id and a 256-byte key.
+        count = data.read_count(4 + 256)
 
-        return {read_qt_int32(data): data.read(256) for _ in range(count)}
+        return {read_qt_int32(data): data.read_bytes(256) for _ in range(count)}
 
     mtp_data = MtpData()
     mtp_data.user_id = user_id
@@ -74,12 +86,21 @@ def read_mtp_authorization(data: BytesIO) -> MtpData:
     return mtp_data
 
 
+def read_mtp_data_settings(version, mtp_data_settings) -> MtpData:
+    blocks = index_settings_blocks(version, QtCursor(mtp_data_settings))
+    mtp_authorization = blocks[SettingsBlock.dbiMtpAuthorization]
+    return read_mtp_authorization(QtCursor(mtp_authorization))
+
+
 class AccountReader:
-    def __init__(self, io: TdataFileIo, index: int, dataname: str):
+    def __init__(
+        self, io: TdataFileIo, index: int, dataname: str, dedup: TdfDedupCache = None
+    ):
         self._io = io
         self._index = index
         self._account_name = compose_account_name(dataname, index)
         self._dataname_key = compute_data_name_key(self._account_name)
+        self._dedup = dedup
 
     def read(self, local_key: bytes) -> ParsedAccount:
         parsed_account = ParsedAccount()
@@ -88,18 +109,37 @@ class AccountReader:
         return parsed_account
 
     def read_mtp_data(self, local_key: bytes) -> MtpData:
-        version, mtp_data_settings = self._io.read_encrypted_file(
-            self._dataname_key, local_key
+        if self._dedup is None:
+            version, mtp_data_settings = self._io.read_encrypted_file(
+                self._dataname_key, local_key
+            )
+            return read_mtp_data_settings(version, mtp_data_settings)
+
+        account_tdf = self._io.read_tdf_file(self._dataname_key)
+        return self._dedup.get_or_compute(
+            "account",
+            account_tdf,
+            local_key,
+            lambda: read_mtp_data_settings(
+                account_tdf.version, decrypt_encrypted_tdf(account_tdf, local_key)
+            ),
         )
-        blocks = read_settings_blocks(version, BytesIO(mtp_data_settings))
-        mtp_authorization = blocks[SettingsBlock.dbiMtpAuthorization]
-        return read_mtp_authorization(BytesIO(mtp_authorization))
+
+
+def decode_settings(
+    settings: Optional[SettingsIndex],
+) -> Optional[Dict[SettingsBlock, Any]]:
+    return None if settings is None else settings.decode_all()
 
 
 class ParsedTdata:
     def __init__(self):
-        self.settings: Optional[Dict[SettingsBlock, Any]] = None
+        self.settings: Optional[Mapping[SettingsBlock, Any]] = None
         self.accounts: Dict[int, ParsedAccount] = None
+        self.stats: Optional[ReadStats] = None
+
+
+KEY_FILE_PREFIX = "key_"
 
 
 class TdataReaderException(Exception):
@@ -113,9 +153,17 @@ class NoKeyFileException(TdataReaderException):
 class TdataReader:
     DEFAULT_DATANAME = "data"
 
-    def __init__(self, io: Tuple[str, TdataFileIo], dataname: str = None):
+    def __init__(
+        self,
+        io: Tuple[str, TdataFileIo],
+        dataname: str = None,
+        key_cache: DerivedKeyCache = None,
+        dedup: TdfDedupCache = None,
+    ):
         """
         io is either the path to the tdata/ folder or TdataFileIo object
+        key_cache is an optional cache of derived keys shared between runs
+        dedup is an optional cache sharing the results of identical files between readers
         """
 
         if isinstance(io, str):
@@ -123,17 +171,46 @@ class TdataReader:
 
         self._io = io
         self._dataname = dataname or TdataReader.DEFAULT_DATANAME
+        self._key_cache = key_cache
+        self._dedup = dedup
+
+    def read(
+        self, passcode: str = None, with_settings: bool = True, with_stats: bool = False
+    ) -> ParsedTdata:
+        """
+        With with_settings = False the settings file is not read nor decrypted
+        and ParsedTdata.settings is None. Otherwise every settings block is
+        decoded here, so a malformed block fails this read like any other
+        file; read_settings decodes the blocks on access.
+        With with_stats = True ParsedTdata.stats holds the per-stage statistics.
+        """
+        if not with_stats:
+            return self._read(passcode, with_settings)
+
+        # The crypto backend is selected with a benchmark on first use,
+        # outside of the timed stages.
+        get_backend()
+
+        with collect_stats() as stats:
+            parsed_tdata = self._read(passcode, with_settings)
 
-    def read(self, passcode: str = None) -> ParsedTdata:
+        parsed_tdata.stats = stats
+        return parsed_tdata
+
+    def _read(self, passcode: str, with_settings: bool) -> ParsedTdata:
         parsed_tdata = ParsedTdata()
-        parsed_tdata.settings = self.read_settings()
+
+        if with_settings:
+            parsed_tdata.settings = decode_settings(self.read_settings())
 
         local_key, account_indexes = self.read_key_data(passcode)
 
         accounts = {}
 
         for account_index in account_indexes:
-            account_reader = AccountReader(self._io, account_index, self._dataname)
+            account_reader = AccountReader(
+                self._io, account_index, self._dataname, self._dedup
+            )
             accounts[account_index] = account_reader.read(local_key)
 
         parsed_tdata.accounts = accounts
@@ -143,27 +220,196 @@ class TdataReader:
         if passcode is None:
             passcode = ""
 
-        try:
-            key_data_tdf = self._io.read_tdf_file(self._key_data_name())
-        except FileNotFoundError as exc:
-            raise NoKeyFileException("no key file") from exc
+        passcode = passcode.encode()
+        key_data_tdf = self.read_key_data_tdf()
 
+        if self._dedup is None:
+            return self._decrypt_key_data(passcode, key_data_tdf)
+
+        return self._dedup.get_or_compute(
+            "key_data",
+            key_data_tdf,
+            passcode,
+            lambda: self._decrypt_key_data(passcode, key_data_tdf),
+        )
+
+    def _decrypt_key_data(
+        self, passcode: bytes, key_data_tdf: RawTdfFile
+    ) -> Tuple[bytes, List[int]]:
         local_key, account_indexes_data = decrypt_key_data_tdf(
-            passcode.encode(), key_data_tdf
+            passcode, key_data_tdf, self._key_cache
         )
-        account_indexes, _ = read_key_data_accounts(BytesIO(account_indexes_data))
+        account_indexes, _ = read_key_data_accounts(QtCursor(account_indexes_data))
 
         return local_key, account_indexes
 
-    def read_settings(self) -> Optional[Dict[SettingsBlock, Any]]:
+    def read_key_data_tdf(self) -> RawTdfFile:
+        try:
+            return self._io.read_tdf_file(self._key_data_name())
+        except FileNotFoundError as exc:
+            raise NoKeyFileException("no key file") from exc
+
+    def read_settings(self) -> Optional[SettingsIndex]:
         try:
             settings_tdf = self._io.read_tdf_file("settings")
         except FileNotFoundError:
             # No settings file.
             return None
 
-        settings_decrypted = decrypt_settings_tdf(settings_tdf)
-        return read_settings_blocks(settings_tdf.version, BytesIO(settings_decrypted))
+        if self._dedup is None:
+            settings_decrypted = self._decrypt_settings(settings_tdf)
+        else:
+            # Only the immutable plaintext is shared: every reader builds its
+            # own index, which holds the decoded blocks.
+            settings_decrypted = self._dedup.get_or_compute(
+                "settings",
+                settings_tdf,
+                None,
+                lambda: self._decrypt_settings(settings_tdf),
+            )
+
+        return index_settings_blocks(settings_tdf.version, QtCursor(settings_decrypted))
+
+    def _decrypt_settings(self, settings_tdf: RawTdfFile) -> bytes:
+        return bytes(decrypt_settings_tdf(settings_tdf, self._key_cache))
 
     def _key_data_name(self):
-        return "key_" + self._dataname
+        return KEY_FILE_PREFIX + self._dataname
+
+
+def list_datanames(io: TdataFileIo) -> List[str]:
+    """
+    Datanames of the key_* files of a tdata/ folder, sorted.
+    Telegram Desktop writes key_<dataname>s, but a dataname may end with "s"
+    itself. The trailing "s" is taken as the suffix only when key_<name>
+    also exists, or when the first account file of the unsuffixed dataname
+    exists (its name is hashed from the dataname). Otherwise the dataname
+    is kept as listed, and its key file still resolves through read_tdf_file.
+    """
+    names = set(io.list_files(""))
+    datanames = set()
+
+    for name in names:
+        if not name.startswith(KEY_FILE_PREFIX) or len(name) == len(KEY_FILE_PREFIX):
+            continue
+
+        dataname = name[len(KEY_FILE_PREFIX) :]
+
+        if dataname.endswith("s") and len(dataname) > 1:
+            unsuffixed = dataname[:-1]
+            account_name = compute_data_name_key(unsuffixed)
+
+            if (
+                KEY_FILE_PREFIX + unsuffixed in names
+                or account_name in names
+                or account_name + "s" in names
+            ):
+                dataname = unsuffixed
+
+        datanames.add(dataname)
+
+    return sorted(datanames)
+
+
+# Key of ParsedTdataFolder.errors for the settings file. Not a valid dataname
+# key: datanames come from key_* file names, which cannot hold a slash.
+SETTINGS_ERROR_KEY = "settings/"
+
+
+class ParsedTdataFolder:
+    def __init__(self):
+        # Shared by all datanames, also set as their ParsedTdata.settings.
+        self.settings: Optional[Mapping[SettingsBlock, Any]] = None
+        self.datanames: Dict[str, ParsedTdata] = {}
+        # Dataname to the error of every dataname which could not be read,
+        # the error of the settings file is under SETTINGS_ERROR_KEY.
+        self.errors: Dict[str, str] = {}
+
+    def __repr__(self):
+        return (
+            f"ParsedTdataFolder(datanames={list(self.datanames)}, "
+            f"errors={self.errors})"
+        )
+
+
+class TdataFolderReader:
+    """
+    Reads every dataname of a tdata/ folder (one key_* file per dataname,
+    from the -key launch option or several profiles) in one pass.
+    Each dataname has its own TdataReader and account folder names,
+    the settings file is shared and read once.
+    """
+
+    def __init__(
+        self,
+        io: Tuple[str, TdataFileIo],
+        key_cache: DerivedKeyCache = None,
+        dedup: TdfDedupCache = None,
+        workers: int = None,
+    ):
+        """
+        io is either the path to the tdata/ folder or TdataFileIo object
+        Datanames are read in a pool of workers threads, key derivation
+        releases the GIL.
+        """
+        if isinstance(io, str):
+            io = TdataFileSystem(io)
+
+        self._io = io
+        self._key_cache = key_cache
+        self._dedup = dedup
+        self._workers = workers
+
+    def datanames(self) -> List[str]:
+        return list_datanames(self._io)
+
+    def read(
+        self, passcode: str = None, with_settings: bool = True, with_stats: bool = False
+    ) -> ParsedTdataFolder:
+        """
+        A dataname which fails (another passcode, a corrupted file)
+        is reported in ParsedTdataFolder.errors, so is the settings file
+        under SETTINGS_ERROR_KEY.
+        """
+        parsed_folder = ParsedTdataFolder()
+        datanames = self.datanames()
+
+        if not datanames:
+            raise NoKeyFileException("no key file")
+
+        if with_settings:
+            try:
+                parsed_folder.settings = decode_settings(
+                    TdataReader(
+                        self._io, key_cache=self._key_cache, dedup=self._dedup
+                    ).read_settings()
+                )
+            except Exception as exc:
+                error = f"{type(exc).__name__}: {exc}"
+                parsed_folder.errors[SETTINGS_ERROR_KEY] = error
+
+        def read(dataname: str) -> Tuple[str, Optional[ParsedTdata], Optional[str]]:
+            reader = TdataReader(self._io, dataname, self._key_cache, self._dedup)
+
+            try:
+                return dataname, reader.read(passcode, False, with_stats), None
+            except Exception as exc:
+                return dataname, None, f"{type(exc).__name__}: {exc}"
+
+        with ThreadPoolExecutor(self._workers) as executor:
+            # Threads do not inherit the context: parse_limits and
+            # collect_stats of the caller are passed in a copy.
+            futures = [
+                executor.submit(copy_context().run, read, dataname)
+                for dataname in datanames
+            ]
+            results = [future.result() for future in futures]
+
+        for dataname, parsed_tdata, error in results:
+            if error is None:
+                parsed_tdata.settings = parsed_folder.settings
+                parsed_folder.datanames[dataname] = parsed_tdata
+            else:
+                parsed_folder.errors[dataname] = error
+
+        return parsed_folder
@@ -0,0 +1,115 @@
+import threading
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, TypeVar
+
+from tdesktop_decrypter.tdf import RawTdfFile
+
+T = TypeVar("T")
+
+
+class DedupStats:
+    """
+    Lookups and hits of a TdfDedupCache per kind of file.
+    """
+
+    def __init__(self):
+        self.lookups: Dict[str, int] = {}
+        self.hits: Dict[str, int] = {}
+
+    def record(self, kind: str, hit: bool):
+        self.lookups[kind] = self.lookups.get(kind, 0) + 1
+
+        if hit:
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+
+    def merge(self, other: "DedupStats"):
+        for kind, lookups in other.lookups.items():
+            self.lookups[kind] = self.lookups.get(kind, 0) + lookups
+
+        for kind, hits in other.hits.items():
+            self.hits[kind] = self.hits.get(kind, 0) + hits
+
+    def copy(self) -> "DedupStats":
+        stats = DedupStats()
+        stats.merge(self)
+        return stats
+
+    def since(self, earlier: "DedupStats") -> "DedupStats":
+        """
+        Lookups and hits recorded after earlier was copied.
+        """
+        stats = DedupStats()
+        stats.lookups = {
+            kind: lookups - earlier.lookups.get(kind, 0)
+            for kind, lookups in self.lookups.items()
+        }
+        stats.hits = {
+            kind: hits - earlier.hits.get(kind, 0) for kind, hits in self.hits.items()
+        }
+        return stats
+
+    def hit_rate(self, kind: str) -> float:
+        lookups = self.lookups.get(kind, 0)
+        return self.hits.get(kind, 0) / lookups if lookups else 0.0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            kind: {
+                "lookups": lookups,
+                "hits": self.hits.get(kind, 0),
+                "hit_rate": self.hit_rate(kind),
+            }
+            for kind, lookups in self.lookups.items()
+        }
+
+    def __repr__(self):
+        return f"DedupStats(lookups={self.lookups!r}, hits={self.hits!r})"
+
+
+class TdfDedupCache:
+    """
+    In-memory cache of results computed from TDF files, shared by the
+    readers of a run. A result is keyed by the kind of file, the MD5
+    hashsum and size of the file (checked by parse_raw_tdf) and the
+    secret it was decrypted with, so byte-identical copies are decrypted
+    and parsed once.
+    Failures are not cached. At most max_entries results are kept,
+    the least recently used ones are dropped.
+    """
+
+    DEFAULT_MAX_ENTRIES = 65536
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.stats = DedupStats()
+
+    def get_or_compute(
+        self, kind: str, tdf: RawTdfFile, secret: Hashable, compute: Callable[[], T]
+    ) -> T:
+        key = (kind, tdf.hashsum, len(tdf.encrypted_data), secret)
+
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.stats.record(kind, False)
+            else:
+                self._entries.move_to_end(key)
+                self.stats.record(kind, True)
+                return value
+
+        # Computed outside of the lock: two threads missing the same key
+        # both compute it, which is harmless.
+        value = compute()
+
+        with self._lock:
+            self._entries[key] = value
+
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+        return value
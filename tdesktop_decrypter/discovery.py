@@ -0,0 +1,148 @@
+import os
+import threading
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AbstractSet, Iterable, Iterator, List, Tuple
+
+from tdesktop_decrypter.tdf import TDF_MAGIC
+
+
+def has_tdf_magic(path: str) -> bool:
+    """
+    Reads only the first 4 bytes of the file.
+    """
+    try:
+        with open(path, "rb", buffering=0) as f:
+            return f.read(len(TDF_MAGIC)) == TDF_MAGIC
+    except OSError:
+        return False
+
+
+class TdataDiscovery:
+    """
+    Finds tdata/ folders: folders with a key_* file starting with the TDF magic.
+    """
+
+    # Subtrees which never hold tdata/ folders.
+    DEFAULT_PRUNE = frozenset(
+        {
+            ".git",
+            ".hg",
+            ".svn",
+            "node_modules",
+            "__pycache__",
+            "site-packages",
+        }
+    )
+
+    def __init__(
+        self,
+        follow_symlinks: bool = False,
+        prune: AbstractSet[str] = DEFAULT_PRUNE,
+        threads: int = 1,
+        descend_into_tdata: bool = False,
+    ):
+        """
+        prune is a set of directory names which are not descended into.
+        With follow_symlinks, directories reached twice (symlink loops) are skipped.
+        With threads > 1, directories are scanned in a thread pool and
+        the order of found folders is not deterministic.
+        descend_into_tdata also walks the subfolders of found tdata/ folders.
+        """
+        self._follow_symlinks = follow_symlinks
+        self._prune = prune
+        self._threads = threads
+        self._descend_into_tdata = descend_into_tdata
+        self._visited_lock = threading.Lock()
+
+    def find(self, roots: Iterable[str]) -> Iterator[str]:
+        if isinstance(roots, str):
+            roots = [roots]
+
+        self._visited = set()
+        roots = [root for root in roots if self._first_visit(root)]
+
+        if self._threads > 1:
+            yield from self._find_threaded(roots)
+        else:
+            yield from self._find_sequential(roots)
+
+    def _find_sequential(self, roots: List[str]) -> Iterator[str]:
+        stack = list(reversed(roots))
+
+        while stack:
+            path = stack.pop()
+            is_tdata, subdirs = self._scan(path)
+
+            if is_tdata:
+                yield path
+
+            stack.extend(reversed(subdirs))
+
+    def _find_threaded(self, roots: List[str]) -> Iterator[str]:
+        with ThreadPoolExecutor(self._threads) as executor:
+            pending = {executor.submit(self._scan, root): root for root in roots}
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    path = pending.pop(future)
+                    is_tdata, subdirs = future.result()
+
+                    if is_tdata:
+                        yield path
+
+                    for subdir in subdirs:
+                        pending[executor.submit(self._scan, subdir)] = subdir
+
+    def _scan(self, path: str) -> Tuple[bool, List[str]]:
+        subdirs = []
+        key_files = []
+
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.name.startswith("key_"):
+                            if entry.is_file(follow_symlinks=self._follow_symlinks):
+                                key_files.append(entry.path)
+                        elif entry.is_dir(follow_symlinks=self._follow_symlinks):
+                            if entry.name not in self._prune:
+                                subdirs.append(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            # Unreadable directory.
+            return False, []
+
+        is_tdata = any(has_tdf_magic(key_file) for key_file in key_files)
+
+        if is_tdata and not self._descend_into_tdata:
+            subdirs = []
+
+        if self._follow_symlinks:
+            subdirs = [subdir for subdir in subdirs if self._first_visit(subdir)]
+
+        return is_tdata, subdirs
+
+    def _first_visit(self, path: str) -> bool:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+
+        key = (st.st_dev, st.st_ino)
+
+        with self._visited_lock:
+            if key in self._visited:
+                return False
+
+            self._visited.add(key)
+            return True
+
+
+def find_tdata_dirs(
+    roots: Iterable[str], threads: int = 1, follow_symlinks: bool = False
+) -> Iterator[str]:
+    return TdataDiscovery(follow_symlinks=follow_symlinks, threads=threads).find(roots)
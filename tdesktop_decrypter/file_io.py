@@ -1,11 +1,54 @@
 import os
+import mmap
+import posixpath
 
-from typing import Tuple
-from io import BytesIO
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-from tdesktop_decrypter.crypto import decrypt_local
-from tdesktop_decrypter.tdf import RawTdfFile, parse_raw_tdf
-from tdesktop_decrypter.qt import read_qt_byte_array
+from tdesktop_decrypter.crypto import (
+    DEFAULT_STREAM_CHUNK_SIZE,
+    decrypt_local,
+    decrypt_local_stream,
+)
+from tdesktop_decrypter.tdf import RawTdfFile, parse_raw_tdf, stream_raw_tdf
+from tdesktop_decrypter.qt import (
+    QtCursor,
+    QtStreamTruncated,
+    current_limits,
+    read_qt_byte_array_view,
+)
+from tdesktop_decrypter.stats import instrumented
+
+
+def decrypt_encrypted_tdf(tdf_file: RawTdfFile, local_key: bytes) -> memoryview:
+    encrpyted_data = read_qt_byte_array_view(QtCursor(tdf_file.encrypted_data))
+    return decrypt_local(encrpyted_data, local_key)
+
+
+def _qt_byte_array_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Streaming read_qt_byte_array: yields the content of the byte array at the
+    start of the chunked data. The chunks after it are consumed and dropped.
+    """
+    header = b""
+    remaining = None
+
+    for chunk in chunks:
+        if remaining is None:
+            header += chunk
+            if len(header) < 4:
+                continue
+
+            # A null byte array has the length -1.
+            remaining = max(int.from_bytes(header[:4], "big", signed=True), 0)
+            chunk = header[4:]
+
+        if remaining:
+            piece = chunk[:remaining]
+            remaining -= len(piece)
+            yield piece
+
+    if remaining is None or remaining:
+        raise QtStreamTruncated("byte array is truncated")
 
 
 class TdataFileIo:
@@ -14,14 +57,27 @@ class TdataFileIo:
         Reads a file from filesystem or some other data provider.
         Path is a relative path to the file without leading slash.
         For example, path = 'settings'
-        Returns the file's data if the file exists, otherwise raises FileNotFoundError.
+        Returns the file's data (any bytes-like object) if the file exists,
+        otherwise raises FileNotFoundError.
+        '''
+        raise NotImplementedError()
+
+    def list_files(self, path: str) -> List[str]:
+        '''
+        Returns the names of the files (not directories) of a directory.
+        Path is relative like in read_file, '' is the tdata/ folder itself.
+        Raises FileNotFoundError if the directory does not exist.
         '''
         raise NotImplementedError()
     
-    def read_tdf_file(self, path: str) -> RawTdfFile:
-        candidates = [path + "s", path]
+    def tdf_candidates(self, path: str) -> List[str]:
+        """
+        Names a TDF file may be stored under, in the order they are tried.
+        """
+        return [path + "s", path]
 
-        for candidate in candidates:
+    def read_tdf_file(self, path: str) -> RawTdfFile:
+        for candidate in self.tdf_candidates(path):
             try:
                 return parse_raw_tdf(self.read_file(candidate))
             except FileNotFoundError:
@@ -29,10 +85,25 @@ class TdataFileIo:
 
         raise FileNotFoundError(path)
 
-    def read_encrypted_file(self, path: str, local_key: bytes) -> Tuple[int, bytes]:
+    def read_encrypted_file(
+        self, path: str, local_key: bytes
+    ) -> Tuple[int, memoryview]:
+        tdf_file = self.read_tdf_file(path)
+        return tdf_file.version, decrypt_encrypted_tdf(tdf_file, local_key)
+
+    def read_encrypted_file_stream(
+        self, path: str, local_key: bytes, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE
+    ) -> Tuple[int, Iterator[bytes]]:
+        """
+        Streaming read_encrypted_file: returns the version and an iterator over
+        the plaintext, see decrypt_local_stream. This implementation holds the
+        whole file in memory, TdataFileSystem reads it chunk by chunk.
+        """
         tdf_file = self.read_tdf_file(path)
-        encrpyted_data = read_qt_byte_array(BytesIO(tdf_file.encrypted_data))
-        return tdf_file.version, decrypt_local(encrpyted_data, local_key)
+        encrypted_data = read_qt_byte_array_view(QtCursor(tdf_file.encrypted_data))
+        return tdf_file.version, decrypt_local_stream(
+            [encrypted_data], local_key, chunk_size
+        )
 
 
 class TdataFileSystem(TdataFileIo):
@@ -41,6 +112,134 @@ class TdataFileSystem(TdataFileIo):
         
         self._base_path = base_path
     
-    def read_file(self, path: str) -> bytes:
-        with open(os.path.join(self._base_path, path), 'rb') as f:
-            return f.read()
\ No newline at end of file
+    @instrumented("read_file", size=lambda result, *_: len(result))
+    def read_file(self, path: str) -> bytearray:
+        with open(os.path.join(self._base_path, path), 'rb', buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+
+            limits = current_limits()
+            if limits is not None:
+                limits.check_total_bytes(size)
+
+            return self._read_open_file(f, size)
+
+    def _read_open_file(self, f, size: int):
+        data = bytearray(size)
+        size = f.readinto(data)
+
+        # The file may have shrunk since fstat.
+        if size < len(data):
+            del data[size:]
+
+        return data
+
+    def list_files(self, path: str) -> List[str]:
+        with os.scandir(os.path.join(self._base_path, path)) as it:
+            return [entry.name for entry in it if entry.is_file()]
+
+    def read_encrypted_file_stream(
+        self, path: str, local_key: bytes, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE
+    ) -> Tuple[int, Iterator[bytes]]:
+        """
+        Memory use is bounded by chunk_size whatever the file size.
+        The TDF hashsum and msg_key are checked after the last chunk.
+        """
+        for candidate in self.tdf_candidates(path):
+            try:
+                f = open(os.path.join(self._base_path, candidate), "rb")
+            except FileNotFoundError:
+                continue
+
+            try:
+                version, chunks = stream_raw_tdf(
+                    f, os.fstat(f.fileno()).st_size, chunk_size
+                )
+            except BaseException:
+                f.close()
+                raise
+
+            def plaintext() -> Iterator[bytes]:
+                with f:
+                    yield from decrypt_local_stream(
+                        _qt_byte_array_chunks(chunks), local_key, chunk_size
+                    )
+
+            return version, plaintext()
+
+        raise FileNotFoundError(path)
+
+
+class ListingTdataFileSystem(TdataFileSystem):
+    """
+    TdataFileSystem listing every directory once: the listing resolves the
+    TDF candidates and missing files without a failed open, which saves a
+    round trip per candidate on network filesystems.
+    Files of at least mmap_threshold bytes are mapped instead of copied
+    (None disables mapping): a mapped file truncated while in use raises
+    SIGBUS, so mapping is meant for folders that are not being written.
+    Listings are cached for the lifetime of the object, use a new object
+    or invalidate to see new files.
+    """
+
+    DEFAULT_MMAP_THRESHOLD = 1024 * 1024
+
+    def __init__(
+        self, base_path: str, mmap_threshold: Optional[int] = DEFAULT_MMAP_THRESHOLD
+    ):
+        super().__init__(base_path)
+
+        self._mmap_threshold = mmap_threshold
+        # Relative directory to its file names, None if it does not exist.
+        self._listings: Dict[str, Optional[Set[str]]] = {}
+
+    def invalidate(self):
+        self._listings.clear()
+
+    def _listing(self, path: str) -> Optional[Set[str]]:
+        try:
+            return self._listings[path]
+        except KeyError:
+            pass
+
+        try:
+            names = set(super().list_files(path))
+        except (FileNotFoundError, NotADirectoryError):
+            names = None
+
+        self._listings[path] = names
+        return names
+
+    def _exists(self, path: str) -> bool:
+        directory, name = posixpath.split(path)
+        names = self._listing(directory)
+        return names is not None and name in names
+
+    def list_files(self, path: str) -> List[str]:
+        names = self._listing(path)
+        if names is None:
+            raise FileNotFoundError(path)
+
+        return list(names)
+
+    def tdf_candidates(self, path: str) -> List[str]:
+        return [
+            candidate
+            for candidate in super().tdf_candidates(path)
+            if self._exists(candidate)
+        ]
+
+    def read_file(self, path: str):
+        """
+        Returns a bytearray, or a read-only mmap for large files.
+        """
+        if not self._exists(path):
+            raise FileNotFoundError(path)
+
+        return super().read_file(path)
+
+    def _read_open_file(self, f, size: int):
+        if self._mmap_threshold is None or size < max(self._mmap_threshold, 1):
+            return super()._read_open_file(f, size)
+
+        # The mapping stays valid after the file is closed.
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
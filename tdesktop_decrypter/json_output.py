@@ -0,0 +1,49 @@
+from typing import Any, Dict
+
+from tdesktop_decrypter.decrypter import ParsedTdata
+
+
+def display_setting_value(setting: Any) -> str:
+    if isinstance(setting, bytes):
+        return setting.hex()
+
+    if isinstance(setting, dict):
+        return {k: display_setting_value(v) for k, v in setting.items()}
+
+    if isinstance(setting, list):
+        return [display_setting_value(v) for v in setting]
+
+    assert any(isinstance(setting, c) for c in (int, float, str))
+    return setting
+
+
+def tdata_to_json(parsed_tdata: ParsedTdata) -> Dict[str, Any]:
+    accounts = [
+        {
+            "index": account.index,
+            "user_id": account.mtp_data.user_id,
+            "main_dc_id": account.mtp_data.current_dc_id,
+            "dc_auth_keys": {
+                dc_id: key.hex().lower() for dc_id, key in account.mtp_data.keys.items()
+            },
+        }
+        for account in parsed_tdata.accounts.values()
+    ]
+
+    if parsed_tdata.settings is None:
+        settings = None
+    else:
+        settings = {
+            str(k): display_setting_value(v) for k, v in parsed_tdata.settings.items()
+        }
+
+    obj = {
+        "accounts": accounts,
+        "settings": settings,
+    }
+
+    # After the settings, so that their decoding is included.
+    if parsed_tdata.stats is not None:
+        obj["stats"] = parsed_tdata.stats.to_json()
+
+    return obj
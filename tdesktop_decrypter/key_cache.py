@@ -0,0 +1,243 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+from typing import Callable, List, Optional, Tuple
+
+from tdesktop_decrypter.crypto import (
+    create_local_key,
+    create_legacy_local_key,
+    local_key_iterations,
+    legacy_local_key_iterations,
+)
+
+LOCAL_KEY_SIZE = 256
+
+
+class DerivedKeyCache:
+    """
+    On-disk cache of derived local keys.
+
+    Every key is stored in its own file named after a hash of
+    (algorithm, iterations, salt, passcode). A missing directory is created
+    with 0700 permissions, an existing one is left as is, and every entry
+    is created with 0600. Hits refresh the entry's mtime, and when the cache
+    grows over max_entries the least recently used entries are removed.
+    Derivations cheaper than min_iterations are not cached at all:
+    they cost less than a lookup.
+    """
+
+    DEFAULT_MAX_ENTRIES = 4096
+    DEFAULT_MIN_ITERATIONS = 1000
+
+    def __init__(
+        self,
+        directory: Optional[str],
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        min_iterations: int = DEFAULT_MIN_ITERATIONS,
+    ):
+        """
+        directory is None for subclasses keeping the keys elsewhere.
+        """
+        self._directory = directory
+        self._max_entries = max_entries
+        self._min_iterations = min_iterations
+
+        if directory is None:
+            return
+
+        try:
+            os.makedirs(directory, mode=0o700)
+        except FileExistsError:
+            pass
+
+        # Entries written by this process are counted, the directory is
+        # scanned again only when the count crosses max_entries.
+        self._count = len(self._entries())
+
+    def create_local_key(self, passcode: bytes, salt: bytes) -> bytes:
+        return self.get_or_derive(
+            "sha512",
+            local_key_iterations(passcode),
+            passcode,
+            salt,
+            create_local_key,
+        )
+
+    def create_legacy_local_key(self, passcode: bytes, salt: bytes) -> bytes:
+        return self.get_or_derive(
+            "sha1",
+            legacy_local_key_iterations(passcode),
+            passcode,
+            salt,
+            create_legacy_local_key,
+        )
+
+    def put_local_key(self, passcode: bytes, salt: bytes, key: bytes):
+        """
+        Stores a key already derived by create_local_key, e.g. by a passcode recovery.
+        """
+        iterations = local_key_iterations(passcode)
+        if iterations < self._min_iterations:
+            return
+
+        self._put(self._entry_name("sha512", iterations, passcode, salt), key)
+
+    def get_or_derive(
+        self,
+        algorithm: str,
+        iterations: int,
+        passcode: bytes,
+        salt: bytes,
+        derive: Callable[[bytes, bytes], bytes],
+    ) -> bytes:
+        if iterations < self._min_iterations:
+            return derive(passcode, salt)
+
+        name = self._entry_name(algorithm, iterations, passcode, salt)
+
+        key = self._get(name)
+        if key is None:
+            key = derive(passcode, salt)
+            self._put(name, key)
+
+        return key
+
+    def _entry_name(
+        self, algorithm: str, iterations: int, passcode: bytes, salt: bytes
+    ) -> str:
+        h = hashlib.sha256()
+
+        for field in (algorithm.encode(), str(iterations).encode(), salt, passcode):
+            h.update(len(field).to_bytes(4, "little"))
+            h.update(field)
+
+        return h.hexdigest()
+
+    def _get(self, name: str) -> Optional[bytes]:
+        path = os.path.join(self._directory, name)
+
+        try:
+            with open(path, "rb") as f:
+                key = f.read()
+        except FileNotFoundError:
+            return None
+
+        if len(key) != LOCAL_KEY_SIZE:
+            # Truncated or foreign entry.
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return key
+
+    def _put(self, name: str, key: bytes):
+        path = os.path.join(self._directory, name)
+        exists = os.path.exists(path)
+
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self._directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(key)
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        if not exists:
+            self._count += 1
+
+        if self._count > self._max_entries:
+            self._evict()
+
+    def _entries(self) -> List[Tuple[float, str]]:
+        entries = []
+
+        with os.scandir(self._directory) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp"):
+                    continue
+
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        self._count = len(entries)
+
+        if len(entries) <= self._max_entries:
+            return
+
+        entries.sort()
+
+        for _, path in entries[: len(entries) - self._max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        self._count = self._max_entries
+
+
+class MemoryDerivedKeyCache(DerivedKeyCache):
+    """
+    In-memory DerivedKeyCache for long-running processes, safe to share
+    between threads. Lookups are cheap enough to cache every derivation.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DerivedKeyCache.DEFAULT_MAX_ENTRIES,
+        min_iterations: int = 0,
+    ):
+        super().__init__(None, max_entries, min_iterations)
+
+        self._keys: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            key = self._keys.get(name)
+            if key is not None:
+                self._keys.move_to_end(name)
+
+            return key
+
+    def _put(self, name: str, key: bytes):
+        with self._lock:
+            self._keys[name] = key
+
+            while len(self._keys) > self._max_entries:
+                self._keys.popitem(last=False)
+
+
+def cached_create_local_key(
+    passcode: bytes, salt: bytes, key_cache: Optional[DerivedKeyCache]
+) -> bytes:
+    if key_cache is None:
+        return create_local_key(passcode, salt)
+
+    return key_cache.create_local_key(passcode, salt)
+
+
+def cached_create_legacy_local_key(
+    passcode: bytes, salt: bytes, key_cache: Optional[DerivedKeyCache]
+) -> bytes:
+    if key_cache is None:
+        return create_legacy_local_key(passcode, salt)
+
+    return key_cache.create_legacy_local_key(passcode, salt)
@@ -0,0 +1,169 @@
+import os
+import sqlite3
+
+from typing import Iterable, Iterator, List, Tuple
+
+from tdesktop_decrypter.crypto import auth_key_id
+from tdesktop_decrypter.decrypter import MtpData
+from tdesktop_decrypter.batch import BatchResult
+
+# The primary key clusters the rows by key_id: a lookup is one B-tree seek
+# whatever the number of keys. A folder read again is deleted through the
+# path index before its new rows are inserted.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS auth_keys (
+    key_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    account_index INTEGER NOT NULL,
+    dc_id INTEGER NOT NULL,
+    to_destroy INTEGER NOT NULL,
+    PRIMARY KEY (key_id, path, account_index, dc_id, to_destroy)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS auth_keys_path ON auth_keys(path);
+"""
+
+
+def mtp_auth_key_ids(mtp_data: MtpData) -> Iterator[Tuple[int, int, bool]]:
+    """
+    Yields (dc_id, auth_key_id, to_destroy) for every key of keys
+    and keys_to_destroy.
+    """
+    for to_destroy, keys in ((False, mtp_data.keys), (True, mtp_data.keys_to_destroy)):
+        for dc_id, key in (keys or {}).items():
+            yield dc_id, auth_key_id(key), to_destroy
+
+
+def parse_key_id(text: str) -> int:
+    """
+    Parses a key ID given as a signed decimal int64, or as 0x followed by
+    the 16 hex digits of its little-endian encoding (the bytes of the
+    message header). The prefix is required: 16 digits alone are
+    ambiguous between the two forms.
+    """
+    if text[:2].lower() != "0x":
+        return int(text, 10)
+
+    data = bytes.fromhex(text[2:])
+    if len(data) != 8:
+        raise ValueError(f"key ID must be 8 bytes, got {len(data)}")
+
+    return int.from_bytes(data, "little", signed=True)
+
+
+class AuthKeyLocation:
+    def __init__(self):
+        self.key_id: int = None
+        self.path: str = None
+        self.account_index: int = None
+        self.dc_id: int = None
+        self.to_destroy: bool = None
+
+    def __repr__(self):
+        return (
+            f"AuthKeyLocation(key_id={self.key_id}, path={self.path!r}, "
+            f"account_index={self.account_index}, dc_id={self.dc_id})"
+        )
+
+
+class AuthKeyIndex:
+    """
+    Persistent SQLite index from auth key ID to the tdata/ folder, account
+    and DC holding the key. Folders are added with write as they are read,
+    a folder written again replaces its previous keys, so the index is
+    updated incrementally across runs. Rows are inserted in one transaction
+    per batch_size folders.
+    """
+
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        self._batch_size = batch_size
+        self._pending: List[BatchResult] = []
+
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def write(self, result: BatchResult):
+        """
+        Folders which failed to read are skipped, their previous keys are kept.
+        """
+        if not result.ok:
+            return
+
+        self._pending.append(result)
+
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def write_all(self, results: Iterable[BatchResult]) -> int:
+        count = 0
+
+        for result in results:
+            self.write(result)
+            count += 1
+
+        self.flush()
+        return count
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        # Paths are stored absolute, as in SqliteSink.
+        pending = {os.path.abspath(result.path): result for result in self._pending}
+
+        rows = [
+            (key_id, path, account.index, dc_id, to_destroy)
+            for path, result in pending.items()
+            for account in result.parsed_tdata.accounts.values()
+            for dc_id, key_id, to_destroy in mtp_auth_key_ids(account.mtp_data)
+        ]
+
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM auth_keys WHERE path = ?",
+                ((path,) for path in pending),
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO auth_keys"
+                " (key_id, path, account_index, dc_id, to_destroy)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+        self._pending.clear()
+
+    def lookup(self, key_id: int) -> List[AuthKeyLocation]:
+        """
+        Every location of the key, written or pending.
+        """
+        self.flush()
+
+        locations = []
+
+        for path, account_index, dc_id, to_destroy in self._db.execute(
+            "SELECT path, account_index, dc_id, to_destroy FROM auth_keys"
+            " WHERE key_id = ?",
+            (key_id,),
+        ):
+            location = AuthKeyLocation()
+            location.key_id = key_id
+            location.path = path
+            location.account_index = account_index
+            location.dc_id = dc_id
+            location.to_destroy = bool(to_destroy)
+            locations.append(location)
+
+        return locations
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,41 +1,332 @@
+import struct
+
+from contextlib import contextmanager
+from contextvars import ContextVar
 from io import BytesIO
+from typing import Callable, Iterator, List, Optional, Tuple, TypeVar, Union
+
+_INT32 = struct.Struct(">i")
+_UINT32 = struct.Struct(">I")
+_INT64 = struct.Struct(">q")
+_UINT64 = struct.Struct(">Q")
+
+T = TypeVar("T")
+
+
+class QtStreamTruncated(Exception):
+    pass
+
+
+class QtLimitExceeded(Exception):
+    pass
+
+
+class ParseLimits:
+    """
+    Limits of strict parsing for untrusted tdata, see parse_limits.
+    max_total_bytes bounds every file read and every buffer parsed (a decrypted
+    file), it is checked before the file is allocated.
+    max_byte_array_size bounds a single QByteArray, max_count the element
+    count of a list.
+    """
+
+    DEFAULT_MAX_TOTAL_BYTES = 64 * 1024 * 1024
+    DEFAULT_MAX_BYTE_ARRAY_SIZE = 32 * 1024 * 1024
+    DEFAULT_MAX_COUNT = 65536
+
+    def __init__(
+        self,
+        max_total_bytes: int = DEFAULT_MAX_TOTAL_BYTES,
+        max_byte_array_size: int = DEFAULT_MAX_BYTE_ARRAY_SIZE,
+        max_count: int = DEFAULT_MAX_COUNT,
+    ):
+        self.max_total_bytes = max_total_bytes
+        self.max_byte_array_size = max_byte_array_size
+        self.max_count = max_count
+
+    def check_total_bytes(self, size: int):
+        if size > self.max_total_bytes:
+            raise QtLimitExceeded(
+                f"{size} bytes exceed the limit of {self.max_total_bytes} bytes"
+            )
+
+    def __repr__(self):
+        return (
+            f"ParseLimits(max_total_bytes={self.max_total_bytes}, "
+            f"max_byte_array_size={self.max_byte_array_size}, "
+            f"max_count={self.max_count})"
+        )
+
+
+_current_limits: ContextVar[Optional[ParseLimits]] = ContextVar(
+    "tdesktop_decrypter_parse_limits", default=None
+)
+
+
+def current_limits() -> Optional[ParseLimits]:
+    return _current_limits.get()
+
+
+@contextmanager
+def parse_limits(limits: ParseLimits = None) -> Iterator[ParseLimits]:
+    """
+    Enforces limits on the files read and the cursors created in this context
+    (thread or task). Cursors keep the limits they were created with.
+    """
+    if limits is None:
+        limits = ParseLimits()
+
+    token = _current_limits.set(limits)
+    try:
+        yield limits
+    finally:
+        _current_limits.reset(token)
+
+
+class QtCursor:
+    """
+    Reader of Qt QDataStream values (big-endian) over a memoryview.
+    Nothing is copied until a value is returned as bytes.
+    The end of data is checked with at_end, reading past it raises QtStreamTruncated.
+    Within parse_limits, exceeding a limit raises QtLimitExceeded.
+    """
+
+    __slots__ = ("_data", "_offset", "_size", "_limits")
+
+    def __init__(self, data, offset: int = 0):
+        self._data = memoryview(data)
+        self._offset = offset
+        self._size = len(self._data)
+        self._limits = _current_limits.get()
+
+        if self._limits is not None:
+            self._limits.check_total_bytes(self._size)
+
+    @property
+    def data(self) -> memoryview:
+        return self._data
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    @property
+    def remaining(self) -> int:
+        return self._size - self._offset
+
+    @property
+    def at_end(self) -> bool:
+        return self._offset >= self._size
+
+    def _truncated(self, size: int) -> QtStreamTruncated:
+        return QtStreamTruncated(
+            f"need {size} bytes at offset {self._offset}, {self.remaining} left"
+        )
+
+    def _advance(self, size: int) -> int:
+        start = self._offset
+        end = start + size
+
+        if end > self._size:
+            raise self._truncated(size)
+
+        self._offset = end
+        return start
+
+    def skip(self, size: int):
+        self._advance(size)
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        return fmt.unpack_from(self._data, self._advance(fmt.size))
+
+    # The fixed-size readers inline _advance, they are the hottest path.
+
+    def read_int32(self) -> int:
+        start = self._offset
+        if start + 4 > self._size:
+            raise self._truncated(4)
+
+        self._offset = start + 4
+        return _INT32.unpack_from(self._data, start)[0]
+
+    def read_uint32(self) -> int:
+        start = self._offset
+        if start + 4 > self._size:
+            raise self._truncated(4)
+
+        self._offset = start + 4
+        return _UINT32.unpack_from(self._data, start)[0]
+
+    def read_int64(self) -> int:
+        start = self._offset
+        if start + 8 > self._size:
+            raise self._truncated(8)
+
+        self._offset = start + 8
+        return _INT64.unpack_from(self._data, start)[0]
+
+    def read_uint64(self) -> int:
+        start = self._offset
+        if start + 8 > self._size:
+            raise self._truncated(8)
+
+        self._offset = start + 8
+        return _UINT64.unpack_from(self._data, start)[0]
+
+    def read_int32s(self, count: int) -> Tuple[int, ...]:
+        if count <= 0:
+            return ()
+
+        return struct.unpack_from(f">{count}i", self._data, self._advance(4 * count))
+
+    def read_view(self, size: int) -> memoryview:
+        start = self._advance(size)
+        return self._data[start : start + size]
+
+    def read_bytes(self, size: int) -> bytes:
+        return bytes(self.read_view(size))
+
+    def check_count(self, count: int, element_size: int) -> int:
+        """
+        Validates an element count read from the data, negative counts are 0.
+        Every element takes at least element_size bytes: a count the remaining
+        data cannot hold raises QtStreamTruncated before any element is read.
+        """
+        if count <= 0:
+            return 0
+
+        if count * element_size > self.remaining:
+            raise QtStreamTruncated(
+                f"{count} elements of at least {element_size} bytes "
+                f"at offset {self._offset}, {self.remaining} left"
+            )
+
+        if self._limits is not None and count > self._limits.max_count:
+            raise QtLimitExceeded(
+                f"{count} elements exceed the limit of {self._limits.max_count}"
+            )
+
+        return count
+
+    def read_count(self, element_size: int) -> int:
+        """
+        Reads an int32 element count, see check_count.
+        """
+        return self.check_count(self.read_int32(), element_size)
+
+    def read_byte_array_view(self) -> memoryview:
+        length = self.read_int32()
+        if length <= 0:
+            return self._data[0:0]
+
+        if self._limits is not None and length > self._limits.max_byte_array_size:
+            raise QtLimitExceeded(
+                f"byte array of {length} bytes exceeds the limit of "
+                f"{self._limits.max_byte_array_size} bytes"
+            )
+
+        start = self._offset
+        end = start + length
+        if end > self._size:
+            raise self._truncated(length)
+
+        self._offset = end
+        return self._data[start:end]
+
+    def read_byte_array(self) -> bytes:
+        return self.read_byte_array_view().tobytes()
+
+    def read_byte_arrays(self) -> List[bytes]:
+        """
+        Reads an int32 count followed by count byte arrays.
+        """
+        return [self.read_byte_array() for _ in range(self.read_count(4))]
+
+    def read_byte_array_cursor(self) -> "QtCursor":
+        return QtCursor(self.read_byte_array_view())
+
+
+QtInput = Union[QtCursor, BytesIO, bytes]
+
+
+def as_qt_cursor(data: QtInput) -> QtCursor:
+    """
+    Accepts a QtCursor, a bytes-like object or a BytesIO (read from its position).
+    """
+    if isinstance(data, QtCursor):
+        return data
+
+    if isinstance(data, BytesIO):
+        return QtCursor(data.getbuffer(), data.tell())
+
+    return QtCursor(data)
+
+
+def _qt_reader(read: Callable[..., T]) -> Callable[..., T]:
+    """
+    Thin wrapper of a QtCursor reader taking any input of as_qt_cursor.
+    A BytesIO is advanced past the value read, as by the BytesIO readers
+    the read_qt_* functions used to be.
+    """
+
+    def read_qt(data: QtInput, *args) -> T:
+        if type(data) is QtCursor:
+            return read(data, *args)
+
+        cursor = as_qt_cursor(data)
+        value = read(cursor, *args)
+
+        if isinstance(data, BytesIO):
+            data.seek(cursor.offset)
+
+        return value
+
+    return read_qt
+
+
+def _read_integer(data: QtCursor, size: int, signed: bool) -> int:
+    return int.from_bytes(data.read_view(size), "big", signed=signed)
 
 
-def _read_bytes(data: BytesIO, size: int) -> bytes:
-    b = data.read(size)
-    if len(b) != size:
-        raise StopIteration()
+def _read_utf8(data: QtCursor) -> str:
+    return data.read_byte_array().decode("utf16")
 
-    return b
 
+read_qt_integer = _qt_reader(_read_integer)
+read_qt_int32 = _qt_reader(QtCursor.read_int32)
+read_qt_uint32 = _qt_reader(QtCursor.read_uint32)
+read_qt_int64 = _qt_reader(QtCursor.read_int64)
+read_qt_uint64 = _qt_reader(QtCursor.read_uint64)
+read_qt_byte_array = _qt_reader(QtCursor.read_byte_array)
+# The view of a BytesIO keeps its buffer exported: the BytesIO cannot be
+# resized while the view is alive.
+read_qt_byte_array_view = _qt_reader(QtCursor.read_byte_array_view)
+read_qt_utf8 = _qt_reader(_read_utf8)
 
-def read_qt_integer(data: BytesIO, size: int, signed: bool) -> int:
-    return int.from_bytes(_read_bytes(data, size), "big", signed=signed)
 
+# Writers, used to build synthetic tdata.
 
-def read_qt_int32(data: BytesIO) -> int:
-    return read_qt_integer(data, 4, True)
 
+def write_qt_int32(value: int) -> bytes:
+    return _INT32.pack(value)
 
-def read_qt_uint32(data: BytesIO) -> int:
-    return read_qt_integer(data, 4, False)
 
+def write_qt_uint32(value: int) -> bytes:
+    return _UINT32.pack(value)
 
-def read_qt_int64(data: BytesIO) -> int:
-    return read_qt_integer(data, 8, True)
 
+def write_qt_int64(value: int) -> bytes:
+    return _INT64.pack(value)
 
-def read_qt_uint64(data: BytesIO) -> int:
-    return read_qt_integer(data, 8, False)
 
+def write_qt_uint64(value: int) -> bytes:
+    return _UINT64.pack(value)
 
-def read_qt_byte_array(data: BytesIO) -> bytes:
-    length = read_qt_int32(data)
-    if length <= 0:
-        return b""
 
-    return _read_bytes(data, length)
+def write_qt_byte_array(data: bytes) -> bytes:
+    return _INT32.pack(len(data)) + bytes(data)
 
 
-def read_qt_utf8(data: BytesIO) -> str:
-    return read_qt_byte_array(data).decode("utf16")
+def write_qt_utf8(text: str) -> bytes:
+    # Mirrors read_qt_utf8.
+    return write_qt_byte_array(text.encode("utf16"))
@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import hashlib
+import itertools
+import queue
+import multiprocessing
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from tdesktop_decrypter.tdf import RawTdfFile
+from tdesktop_decrypter.crypto import CryptoException, create_local_key, decrypt_local
+from tdesktop_decrypter.storage import read_key_data_tdf
+
+Candidate = Union[str, bytes]
+
+
+class RecoveryProgress:
+    def __init__(self):
+        self.tried: int = 0
+        self.elapsed: float = 0.0
+        self.rate: float = 0.0
+
+    def __repr__(self):
+        return (
+            f"RecoveryProgress(tried={self.tried}, "
+            f"rate={self.rate:.1f} candidates/s)"
+        )
+
+
+def read_wordlist(path: str) -> Iterator[bytes]:
+    """
+    Streams passcode candidates from a wordlist file, one per line.
+    """
+    with open(path, "rb") as f:
+        for line in f:
+            yield line.rstrip(b"\r\n")
+
+
+def _encode_candidate(candidate: Candidate) -> bytes:
+    if isinstance(candidate, str):
+        return candidate.encode()
+
+    return candidate
+
+
+def try_passcode(
+    passcode: bytes, salt: bytes, key_encrypted: bytes
+) -> Optional[bytes]:
+    """
+    Returns the passcode key if passcode decrypts key_encrypted, otherwise None.
+    """
+    passcode_key = create_local_key(passcode, salt)
+
+    try:
+        decrypt_local(key_encrypted, passcode_key)
+    except CryptoException:
+        return None
+
+    return passcode_key
+
+
+def check_passcode(passcode: bytes, salt: bytes, key_encrypted: bytes) -> bool:
+    return try_passcode(passcode, salt, key_encrypted) is not None
+
+
+# Worker process state, set once by _init_worker.
+_worker_salt: bytes = None
+_worker_key_encrypted: bytes = None
+_worker_stop = None
+
+
+def _init_worker(salt: bytes, key_encrypted: bytes, stop):
+    global _worker_salt, _worker_key_encrypted, _worker_stop
+
+    _worker_salt = salt
+    _worker_key_encrypted = key_encrypted
+    _worker_stop = stop
+
+
+# (number of candidates tried, passcode, passcode key), the last two are None
+# when no candidate of the chunk matched.
+ChunkResult = Tuple[int, Optional[bytes], Optional[bytes]]
+
+
+def _check_chunk(chunk: List[bytes]) -> ChunkResult:
+    tried = 0
+
+    for passcode in chunk:
+        if _worker_stop.is_set():
+            break
+
+        tried += 1
+        passcode_key = try_passcode(passcode, _worker_salt, _worker_key_encrypted)
+
+        if passcode_key is not None:
+            # Other workers stop at their next candidate.
+            _worker_stop.set()
+            return tried, passcode, passcode_key
+
+    return tried, None, None
+
+
+class PasscodeRecovery:
+    def __init__(
+        self,
+        key_data_tdf: RawTdfFile,
+        workers: int = None,
+        chunksize: int = 16,
+        checkpoint_path: str = None,
+        progress: Callable[[RecoveryProgress], None] = None,
+        progress_interval: float = 1.0,
+    ):
+        """
+        key_data_tdf is parsed once and shared by all workers.
+        workers is the number of worker processes, defaults to the number of CPUs.
+        checkpoint_path is a file where the number of processed candidates
+        is saved, so an interrupted run over the same candidates can be resumed.
+        progress is called with a RecoveryProgress at most every progress_interval seconds.
+        """
+        salt, key_encrypted, _ = read_key_data_tdf(key_data_tdf)
+        self._salt = salt
+        self._key_encrypted = bytes(key_encrypted)
+        self._workers = workers or os.cpu_count() or 1
+        self._chunksize = chunksize
+        self._checkpoint_path = checkpoint_path
+        self._progress = progress
+        self._progress_interval = progress_interval
+        # The key derived from the passcode found by run, see key_cache.
+        self.passcode_key: Optional[bytes] = None
+
+    @property
+    def salt(self) -> bytes:
+        return self._salt
+
+    def run(self, candidates: Iterable[Candidate]) -> Optional[bytes]:
+        """
+        Returns the passcode which decrypts key_data or None if no candidate matched.
+        """
+        offset = self._load_checkpoint()
+        candidates = itertools.islice(candidates, offset, None)
+        chunks = self._chunks(candidates)
+
+        progress = RecoveryProgress()
+        progress.tried = offset
+        self._resumed_from = offset
+        # Candidates up to the checkpoint offset are all tried, progress.tried
+        # also counts chunks completed ahead of it.
+        self._checkpoint_offset = offset
+        self._started = time.monotonic()
+        self._reported = self._started
+
+        if self._workers == 1:
+            found = self._run_inline(chunks, progress)
+        else:
+            found = self._run_pool(chunks, progress)
+
+        self._report(progress, force=True)
+
+        if found is not None:
+            self._remove_checkpoint()
+
+        return found
+
+    def _chunks(self, candidates: Iterable[Candidate]) -> Iterator[List[bytes]]:
+        candidates = map(_encode_candidate, candidates)
+
+        while True:
+            chunk = list(itertools.islice(candidates, self._chunksize))
+            if not chunk:
+                return
+
+            yield chunk
+
+    def _run_inline(
+        self, chunks: Iterator[List[bytes]], progress: RecoveryProgress
+    ) -> Optional[bytes]:
+        for chunk in chunks:
+            for passcode in chunk:
+                progress.tried += 1
+                passcode_key = try_passcode(passcode, self._salt, self._key_encrypted)
+
+                if passcode_key is not None:
+                    self.passcode_key = passcode_key
+                    return passcode
+
+            self._checkpoint_offset += len(chunk)
+            self._report(progress)
+
+        return None
+
+    def _run_pool(
+        self, chunks: Iterator[List[bytes]], progress: RecoveryProgress
+    ) -> Optional[bytes]:
+        stop = multiprocessing.Event()
+        pool = multiprocessing.Pool(
+            self._workers,
+            initializer=_init_worker,
+            initargs=(self._salt, self._key_encrypted, stop),
+        )
+
+        # Results are consumed as they complete. The checkpoint only moves
+        # over a contiguous prefix of completed chunks, chunks completed ahead
+        # of it are kept in completed until the gap is filled.
+        # The window bounds the number of candidates held in memory.
+        done: queue.Queue = queue.Queue()
+        in_flight: Dict[int, int] = {}
+        completed: Dict[int, int] = {}
+        next_index = 0
+        window = self._workers * 4
+
+        def submit(index: int, chunk: List[bytes]):
+            in_flight[index] = len(chunk)
+            pool.apply_async(
+                _check_chunk,
+                (chunk,),
+                callback=lambda result: done.put((index, result)),
+                error_callback=lambda exc: done.put((index, exc)),
+            )
+
+        def collect() -> Optional[bytes]:
+            nonlocal next_index
+
+            index, result = done.get()
+            if isinstance(result, BaseException):
+                raise result
+
+            size = in_flight.pop(index)
+            tried, passcode, passcode_key = result
+            progress.tried += tried
+
+            if passcode is not None:
+                self.passcode_key = passcode_key
+                return passcode
+
+            completed[index] = size
+            while next_index in completed:
+                self._checkpoint_offset += completed.pop(next_index)
+                next_index += 1
+
+            self._report(progress)
+            return None
+
+        try:
+            for index, chunk in enumerate(chunks):
+                submit(index, chunk)
+
+                if len(in_flight) >= window:
+                    found = collect()
+                    if found is not None:
+                        return found
+
+            while in_flight:
+                found = collect()
+                if found is not None:
+                    return found
+
+            return None
+        finally:
+            stop.set()
+            pool.terminate()
+            pool.join()
+
+    def _report(self, progress: RecoveryProgress, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._reported < self._progress_interval:
+            return
+
+        self._reported = now
+        self._save_checkpoint(self._checkpoint_offset)
+
+        if self._progress is None:
+            return
+
+        progress.elapsed = now - self._started
+        if progress.elapsed > 0:
+            progress.rate = (progress.tried - self._resumed_from) / progress.elapsed
+
+        self._progress(progress)
+
+    def _checkpoint_id(self) -> str:
+        return hashlib.sha256(self._salt + self._key_encrypted).hexdigest()
+
+    def _load_checkpoint(self) -> int:
+        if self._checkpoint_path is None:
+            return 0
+
+        try:
+            with open(self._checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return 0
+
+        # A checkpoint of another key_data is ignored.
+        if checkpoint.get("key_data") != self._checkpoint_id():
+            return 0
+
+        return checkpoint["offset"]
+
+    def _save_checkpoint(self, offset: int):
+        if self._checkpoint_path is None:
+            return
+
+        tmp_path = self._checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key_data": self._checkpoint_id(), "offset": offset}, f)
+
+        os.replace(tmp_path, self._checkpoint_path)
+
+    def _remove_checkpoint(self):
+        if self._checkpoint_path is None:
+            return
+
+        try:
+            os.remove(self._checkpoint_path)
+        except FileNotFoundError:
+            pass
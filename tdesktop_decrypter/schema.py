@@ -0,0 +1,217 @@
+"""
+Declarative layouts of QDataStream values.
+
+A layout is built from fields (INT32, BYTES, Struct, Framed, ...) and compiled
+once with compile_field. Compilation merges consecutive fixed-width fields of a
+Struct into a single struct.Struct so they are decoded with one unpack_from call,
+and checks the produced value types, so decoded values need no validation.
+"""
+
+import struct
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from tdesktop_decrypter.qt import QtCursor, read_qt_utf8
+
+# Types a decoded value may have.
+VALUE_TYPES = (bool, int, float, str, bytes, dict, list)
+
+
+class IncorrectBlockDataType(Exception):
+    pass
+
+
+class Field:
+    python_type: type = None
+
+
+class Fixed(Field):
+    """
+    Fixed-width value, code is a struct format character (big-endian).
+    """
+
+    def __init__(self, code: str, python_type: type, convert: Callable = None):
+        self.code = code
+        self.python_type = python_type
+        self.convert = convert
+
+
+class Variable(Field):
+    def __init__(
+        self,
+        python_type: type,
+        read: Callable[[QtCursor], Any],
+        skip: Callable[[QtCursor], Any],
+    ):
+        self.python_type = python_type
+        self.read = read
+        self.skip = skip
+
+
+class Struct(Field):
+    """
+    Sequence of named fields decoded to a dict.
+    """
+
+    python_type = dict
+
+    def __init__(self, fields: Sequence[Tuple[str, Field]]):
+        self.fields = list(fields)
+
+
+class Framed(Field):
+    """
+    Value stored inside a QByteArray.
+    """
+
+    def __init__(self, inner: Field):
+        self.inner = inner
+        self.python_type = inner.python_type
+
+
+def _skip_byte_array(data: QtCursor):
+    data.read_byte_array_view()
+
+
+INT32 = Fixed("i", int)
+UINT32 = Fixed("I", int)
+INT64 = Fixed("q", int)
+UINT64 = Fixed("Q", int)
+BOOL = Fixed("i", bool, lambda v: v == 1)
+BYTES = Variable(bytes, QtCursor.read_byte_array, _skip_byte_array)
+# QByteArray holding UTF-8 text.
+BYTES_STR = Variable(str, lambda data: data.read_byte_array().decode(), _skip_byte_array)
+# QString.
+QSTRING = Variable(str, read_qt_utf8, _skip_byte_array)
+
+
+class CompiledField:
+    def __init__(
+        self,
+        python_type: type,
+        read: Callable[[QtCursor], Any],
+        skip: Callable[[QtCursor], Any],
+        size: Optional[int],
+    ):
+        """
+        size is the encoded size of fixed-width fields, None otherwise.
+        """
+        self.python_type = python_type
+        self.read = read
+        self.skip = skip
+        self.size = size
+
+
+def _check_type(python_type: type, where: str):
+    if python_type not in VALUE_TYPES:
+        raise IncorrectBlockDataType(f"{where}: {python_type}")
+
+
+def _compile_fixed(field: Fixed) -> CompiledField:
+    fmt = struct.Struct(">" + field.code)
+    convert = field.convert
+
+    if convert is None:
+
+        def read(data: QtCursor):
+            return data.unpack(fmt)[0]
+
+    else:
+
+        def read(data: QtCursor):
+            return convert(data.unpack(fmt)[0])
+
+    return CompiledField(field.python_type, read, lambda data: data.skip(fmt.size), fmt.size)
+
+
+def _compile_struct(field: Struct) -> CompiledField:
+    # Steps are either a run of fixed fields: (struct.Struct, [(name, convert)])
+    # or a single variable field: (None, (name, read)).
+    steps: List[Tuple[Optional[struct.Struct], Any]] = []
+    run_codes: List[str] = []
+    run_fields: List[Tuple[str, Callable]] = []
+
+    def flush():
+        if run_fields:
+            steps.append((struct.Struct(">" + "".join(run_codes)), list(run_fields)))
+            run_codes.clear()
+            run_fields.clear()
+
+    size = 0
+
+    for name, subfield in field.fields:
+        if not isinstance(name, str):
+            raise IncorrectBlockDataType(f"field name {name!r} is not str")
+
+        if isinstance(subfield, Fixed):
+            _check_type(subfield.python_type, name)
+            run_codes.append(subfield.code)
+            run_fields.append((name, subfield.convert))
+            continue
+
+        flush()
+        compiled = compile_field(subfield)
+        steps.append((None, (name, compiled.read)))
+
+        if compiled.size is None:
+            size = None
+        elif size is not None:
+            size += compiled.size
+
+    flush()
+
+    if size is not None:
+        size += sum(fmt.size for fmt, _ in steps if fmt is not None)
+
+    def read(data: QtCursor) -> Dict[str, Any]:
+        result = {}
+
+        for fmt, fields in steps:
+            if fmt is None:
+                name, read_field = fields
+                result[name] = read_field(data)
+                continue
+
+            for (name, convert), value in zip(fields, data.unpack(fmt)):
+                result[name] = value if convert is None else convert(value)
+
+        return result
+
+    if size is None:
+
+        def skip(data: QtCursor):
+            read(data)
+
+    else:
+
+        def skip(data: QtCursor):
+            data.skip(size)
+
+    return CompiledField(dict, read, skip, size)
+
+
+def _compile_framed(field: Framed) -> CompiledField:
+    inner = compile_field(field.inner)
+
+    def read(data: QtCursor):
+        return inner.read(data.read_byte_array_cursor())
+
+    return CompiledField(inner.python_type, read, _skip_byte_array, None)
+
+
+def compile_field(field: Field) -> CompiledField:
+    _check_type(field.python_type, type(field).__name__)
+
+    if isinstance(field, Fixed):
+        return _compile_fixed(field)
+
+    if isinstance(field, Struct):
+        return _compile_struct(field)
+
+    if isinstance(field, Framed):
+        return _compile_framed(field)
+
+    if isinstance(field, Variable):
+        return CompiledField(field.python_type, field.read, field.skip, None)
+
+    raise TypeError(f"unknown field: {field!r}")
@@ -0,0 +1,166 @@
+"""
+Long-running decryption server over a Unix socket.
+
+Protocol: JSON lines. Every request line is an object
+    {"id": any, "paths": [tdata paths], "passcode": str, "settings": bool, "dataname": str}
+("path" may replace "paths", every field but the paths is optional) and is
+answered with one line per path, in order:
+    {"id": any, "path": str, "error": str or null, "accounts": [...], "settings": ...}
+with the accounts and settings of the --json output.
+{"id": any, "command": "stats"} is answered with the cache statistics.
+A malformed request is answered with {"id": any, "error": str}.
+"""
+
+import os
+import json
+import socketserver
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List
+
+from tdesktop_decrypter.key_cache import DerivedKeyCache, MemoryDerivedKeyCache
+from tdesktop_decrypter.dedup import TdfDedupCache
+from tdesktop_decrypter.decrypter import TdataReader
+from tdesktop_decrypter.json_output import tdata_to_json
+
+
+class TdataServerException(Exception):
+    pass
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            for response in self.server.tdata_server.handle_line(line):
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TdataServer:
+    """
+    Keeps the derived keys and the decrypted files (by TDF hashsum) in memory
+    between requests, so a repeated request only reads and hashes the files.
+    Connections are served concurrently, the paths of all requests are read
+    in one pool of workers threads (key derivation and file reads release the GIL).
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        workers: int = None,
+        key_cache: DerivedKeyCache = None,
+        dedup: TdfDedupCache = None,
+    ):
+        """
+        key_cache defaults to a MemoryDerivedKeyCache, dedup to a new TdfDedupCache.
+        """
+        self._socket_path = socket_path
+        self._executor = ThreadPoolExecutor(workers)
+        self._key_cache = key_cache or MemoryDerivedKeyCache()
+        self._dedup = dedup or TdfDedupCache()
+        self._server = None
+
+    def handle_line(self, line: bytes) -> Iterator[Dict[str, Any]]:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise TdataServerException("request must be an object")
+        except (ValueError, TdataServerException) as exc:
+            yield {"id": None, "error": f"{type(exc).__name__}: {exc}"}
+            return
+
+        request_id = request.get("id")
+
+        try:
+            if request.get("command") == "stats":
+                yield {"id": request_id, "dedup": self._dedup.stats.to_json()}
+                return
+
+            paths = self._request_paths(request)
+        except TdataServerException as exc:
+            yield {"id": request_id, "error": f"{type(exc).__name__}: {exc}"}
+            return
+
+        futures = [
+            self._executor.submit(
+                self._read,
+                path,
+                request.get("passcode"),
+                bool(request.get("settings", False)),
+                request.get("dataname"),
+            )
+            for path in paths
+        ]
+
+        for path, future in zip(paths, futures):
+            response = {"id": request_id}
+            response.update(future.result())
+            yield response
+
+    def _request_paths(self, request: Dict[str, Any]) -> List[str]:
+        if "command" in request:
+            raise TdataServerException(f"unknown command {request['command']!r}")
+
+        paths = request.get("paths")
+        if paths is None and "path" in request:
+            paths = [request["path"]]
+
+        if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+            raise TdataServerException("paths must be a list of strings")
+
+        return paths
+
+    def _read(
+        self, path: str, passcode: str, with_settings: bool, dataname: str
+    ) -> Dict[str, Any]:
+        response = {"path": path, "error": None}
+
+        try:
+            reader = TdataReader(path, dataname, self._key_cache, self._dedup)
+            response.update(tdata_to_json(reader.read(passcode, with_settings)))
+        except Exception as exc:
+            response["error"] = f"{type(exc).__name__}: {exc}"
+
+        return response
+
+    def serve_forever(self):
+        """
+        The socket is created with 0600 permissions: responses hold auth keys.
+        A stale socket file is replaced.
+        """
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _UnixServer(self._socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+        self._server.tdata_server = self
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._executor.shutdown(wait=False)
+
+            try:
+                os.remove(self._socket_path)
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        """
+        Stops serve_forever from another thread.
+        """
+        if self._server is not None:
+            self._server.shutdown()
@@ -1,12 +1,24 @@
-from typing import Any, Dict, Tuple
-from io import BytesIO
+from typing import Any, Dict, Iterator, Mapping, Tuple
 from enum import Enum
 
-from tdesktop_decrypter.qt import (
-    read_qt_int32,
-    read_qt_uint64,
-    read_qt_byte_array,
-    read_qt_utf8,
+from tdesktop_decrypter.qt import QtCursor, QtStreamTruncated, as_qt_cursor, read_qt_int32
+from tdesktop_decrypter.stats import instrumented
+# IncorrectBlockDataType moved to schema and stays importable from here.
+from tdesktop_decrypter.schema import IncorrectBlockDataType  # noqa: F401
+from tdesktop_decrypter.schema import (
+    CompiledField,
+    Field,
+    Fixed,
+    Framed,
+    Struct,
+    Variable,
+    compile_field,
+    INT32,
+    UINT64,
+    BOOL,
+    BYTES,
+    BYTES_STR,
+    QSTRING,
 )
 
 
@@ -111,186 +123,231 @@ class SettingsBlock(Enum):
     dbiVersion = 666
 
 
-def read_boolean(data: BytesIO) -> bool:
-    return read_qt_int32(data) == 1
-
-
-def read_settings_block(
-    version, data: BytesIO, block_id: SettingsBlock
-) -> Tuple[bool, int, bytes, str, dict]:
-    if block_id == SettingsBlock.dbiAutoStart:
-        return read_boolean(data)
-
-    if block_id == SettingsBlock.dbiStartMinimized:
-        return read_boolean(data)
-
-    if block_id == SettingsBlock.dbiSongVolumeOld:
-        return read_qt_int32(data) / 1e6
-
-    if block_id == SettingsBlock.dbiSendToMenu:
-        return read_boolean(data)
-
-    if block_id == SettingsBlock.dbiSeenTrayTooltip:
-        return read_boolean(data)
-
-    if block_id == SettingsBlock.dbiAutoUpdate:
-        return read_boolean(data)
-
-    if block_id == SettingsBlock.dbiLastUpdateCheck:
-        return read_qt_int32(data)
-
-    if block_id == SettingsBlock.dbiScalePercent:
-        return read_qt_int32(data)
-
-    if block_id == SettingsBlock.dbiFallbackProductionConfig:
-
-        def read_dc_options(data: BytesIO):
-            minus_version = read_qt_int32(data)
-            if minus_version < 0:
-                version = -minus_version
-            else:
-                version = 0
-
-            if version > 0:
-                count = read_qt_int32(data)
-            else:
-                count = minus_version
-
-            dc_options = []
-
-            for _ in range(count):
-                dc_option = {
-                    "id": read_qt_int32(data),
-                    "flags": read_qt_int32(data),
-                    "port": read_qt_int32(data),
-                    "ip": read_qt_byte_array(data).decode(),
-                    "secret": read_qt_byte_array(data),
-                }
-
-                dc_options.append(dc_option)
-
-            cdn_config = []
-
-            if version > 1:
-                count = read_qt_int32(data)
-                for _ in range(count):
-                    cfg = {
-                        "dc_id": read_qt_int32(data),
-                        "n": read_qt_byte_array(data),
-                        "e": read_qt_byte_array(data),
-                    }
-
-                    cdn_config.append(cfg)
-
-            return {"version": version, "dc": dc_options, "cdn": cdn_config}
-
-        def read_fallback_config(data: BytesIO):
-            return {
-                "version": read_qt_int32(data),
-                "environment": read_qt_int32(data),
-                "dc_options": read_dc_options(BytesIO(read_qt_byte_array(data))),
-                "chatSizeMax": read_qt_int32(data),
-                "megagroupSizeMax": read_qt_int32(data),
-                "forwardedCountMax": read_qt_int32(data),
-                "onlineUpdatePeriod": read_qt_int32(data),
-                "offlineBlurTimeout": read_qt_int32(data),
-                "offlineIdleTimeout": read_qt_int32(data),
-                "onlineFocusTimeout": read_qt_int32(data),
-                "onlineCloudTimeout": read_qt_int32(data),
-                "notifyCloudDelay": read_qt_int32(data),
-                "notifyDefaultDelay": read_qt_int32(data),
-                "savedGifsLimit": read_qt_int32(data),  # legacy
-                "editTimeLimit": read_qt_int32(data),
-                "revokeTimeLimit": read_qt_int32(data),
-                "revokePrivateTimeLimit": read_qt_int32(data),
-                "revokePrivateInbox": read_qt_int32(data),
-                "stickersRecentLimit": read_qt_int32(data),
-                "stickersFavedLimit": read_qt_int32(data),  # legacy
-                "pinnedDialogsCountMax": read_qt_int32(data),  # legacy
-                "pinnedDialogsInFolderMax": read_qt_int32(data),  # legacy
-                "internalLinksDomain": read_qt_utf8(data),
-                "channelsReadMediaPeriod": read_qt_int32(data),
-                "callReceiveTimeoutMs": read_qt_int32(data),
-                "callRingTimeoutMs": read_qt_int32(data),
-                "callConnectTimeoutMs": read_qt_int32(data),
-                "callPacketTimeoutMs": read_qt_int32(data),
-                "webFileDcId": read_qt_int32(data),
-                "txtDomainString": read_qt_utf8(data),
-                "phoneCallsEnabled": read_qt_int32(data),  # legacy
-                "blockedMode": read_qt_int32(data),
-                "captionLengthMax": read_qt_int32(data),
-                "reactionDefaultEmoji": read_qt_utf8(data),
-                "reactionDefaultCustom": read_qt_uint64(data),
-            }
-
-        return read_fallback_config(BytesIO(read_qt_byte_array(data)))
-
-    if block_id == SettingsBlock.dbiApplicationSettings:
-        return read_qt_byte_array(data)
-
-    if block_id == SettingsBlock.dbiDialogLastPath:
-        return read_qt_utf8(data)
-
-    if block_id == SettingsBlock.dbiPowerSaving:
-        return read_qt_int32(data)
-
-    if block_id == SettingsBlock.dbiThemeKey:
-        return {
-            "day": read_qt_uint64(data),
-            "night": read_qt_uint64(data),
-            "night_mode": read_boolean(data),
-        }
-
-    if block_id == SettingsBlock.dbiBackgroundKey:
-        return {"day": read_qt_uint64(data), "night": read_qt_uint64(data)}
-
-    if block_id == SettingsBlock.dbiTileBackground:
-        return {"day": read_qt_int32(data), "night": read_qt_int32(data)}
-
-    if block_id == SettingsBlock.dbiLangPackKey:
-        return read_qt_uint64(data)
-
-    if block_id == SettingsBlock.dbiMtpAuthorization:
-        return read_qt_byte_array(data)
-
-    if block_id == SettingsBlock.dbiLanguagesKey:
-        return read_qt_uint64(data)
-
-    raise SettingsReadException(f"Unnown block ID while reading settings: {block_id}")
-
-
-class IncorrectBlockDataType(Exception):
-    pass
+DC_OPTION = compile_field(
+    Struct(
+        [
+            ("id", INT32),
+            ("flags", INT32),
+            ("port", INT32),
+            ("ip", BYTES_STR),
+            ("secret", BYTES),
+        ]
+    )
+)
+
+CDN_CONFIG = compile_field(
+    Struct(
+        [
+            ("dc_id", INT32),
+            ("n", BYTES),
+            ("e", BYTES),
+        ]
+    )
+)
 
 
-def _ensure_correct_block_data_type(d):
-    if any(isinstance(d, c) for c in (int, float, str, bytes)):
-        return
+def read_dc_options(data: QtCursor) -> Dict[str, Any]:
+    minus_version = read_qt_int32(data)
+    if minus_version < 0:
+        version = -minus_version
+    else:
+        version = 0
+
+    # A dc option takes at least 3 int32 and 2 byte array lengths,
+    # a CDN config 1 int32 and 2 lengths.
+    if version > 0:
+        count = data.read_count(20)
+    else:
+        count = data.check_count(minus_version, 20)
+
+    dc_options = [DC_OPTION.read(data) for _ in range(count)]
+
+    cdn_config = []
+
+    if version > 1:
+        count = data.read_count(12)
+        cdn_config = [CDN_CONFIG.read(data) for _ in range(count)]
+
+    return {"version": version, "dc": dc_options, "cdn": cdn_config}
+
+
+FALLBACK_CONFIG = Framed(
+    Struct(
+        [
+            ("version", INT32),
+            ("environment", INT32),
+            ("dc_options", Framed(Variable(dict, read_dc_options, read_dc_options))),
+            ("chatSizeMax", INT32),
+            ("megagroupSizeMax", INT32),
+            ("forwardedCountMax", INT32),
+            ("onlineUpdatePeriod", INT32),
+            ("offlineBlurTimeout", INT32),
+            ("offlineIdleTimeout", INT32),
+            ("onlineFocusTimeout", INT32),
+            ("onlineCloudTimeout", INT32),
+            ("notifyCloudDelay", INT32),
+            ("notifyDefaultDelay", INT32),
+            ("savedGifsLimit", INT32),  # legacy
+            ("editTimeLimit", INT32),
+            ("revokeTimeLimit", INT32),
+            ("revokePrivateTimeLimit", INT32),
+            ("revokePrivateInbox", INT32),
+            ("stickersRecentLimit", INT32),
+            ("stickersFavedLimit", INT32),  # legacy
+            ("pinnedDialogsCountMax", INT32),  # legacy
+            ("pinnedDialogsInFolderMax", INT32),  # legacy
+            ("internalLinksDomain", QSTRING),
+            ("channelsReadMediaPeriod", INT32),
+            ("callReceiveTimeoutMs", INT32),
+            ("callRingTimeoutMs", INT32),
+            ("callConnectTimeoutMs", INT32),
+            ("callPacketTimeoutMs", INT32),
+            ("webFileDcId", INT32),
+            ("txtDomainString", QSTRING),
+            ("phoneCallsEnabled", INT32),  # legacy
+            ("blockedMode", INT32),
+            ("captionLengthMax", INT32),
+            ("reactionDefaultEmoji", QSTRING),
+            ("reactionDefaultCustom", UINT64),
+        ]
+    )
+)
+
+# Layouts of the settings blocks. To decode a new block, add its layout here.
+SETTINGS_BLOCK_LAYOUTS: Dict[SettingsBlock, Field] = {
+    SettingsBlock.dbiAutoStart: BOOL,
+    SettingsBlock.dbiStartMinimized: BOOL,
+    SettingsBlock.dbiSongVolumeOld: Fixed("i", float, lambda v: v / 1e6),
+    SettingsBlock.dbiSendToMenu: BOOL,
+    SettingsBlock.dbiSeenTrayTooltip: BOOL,
+    SettingsBlock.dbiAutoUpdate: BOOL,
+    SettingsBlock.dbiLastUpdateCheck: INT32,
+    SettingsBlock.dbiScalePercent: INT32,
+    SettingsBlock.dbiFallbackProductionConfig: FALLBACK_CONFIG,
+    SettingsBlock.dbiApplicationSettings: BYTES,
+    SettingsBlock.dbiDialogLastPath: QSTRING,
+    SettingsBlock.dbiPowerSaving: INT32,
+    SettingsBlock.dbiThemeKey: Struct(
+        [("day", UINT64), ("night", UINT64), ("night_mode", BOOL)]
+    ),
+    SettingsBlock.dbiBackgroundKey: Struct([("day", UINT64), ("night", UINT64)]),
+    SettingsBlock.dbiTileBackground: Struct([("day", INT32), ("night", INT32)]),
+    SettingsBlock.dbiLangPackKey: UINT64,
+    SettingsBlock.dbiMtpAuthorization: BYTES,
+    SettingsBlock.dbiLanguagesKey: UINT64,
+}
+
+# Compiled once at import: type errors in the layouts surface here.
+_SETTINGS_BLOCK_DECODERS: Dict[SettingsBlock, CompiledField] = {
+    block_id: compile_field(layout)
+    for block_id, layout in SETTINGS_BLOCK_LAYOUTS.items()
+}
+
+
+def _block_decoder(block_id: SettingsBlock) -> CompiledField:
+    try:
+        return _SETTINGS_BLOCK_DECODERS[block_id]
+    except KeyError:
+        raise SettingsReadException(
+            f"Unnown block ID while reading settings: {block_id}"
+        ) from None
+
 
-    if isinstance(d, dict):
-        for k, v in d.items():
-            assert isinstance(k, str)
-            _ensure_correct_block_data_type(v)
-        return
+@instrumented("settings_decode")
+def read_settings_block(version, data: QtCursor, block_id: SettingsBlock) -> Any:
+    return _block_decoder(block_id).read(data)
 
-    if isinstance(d, list):
-        for v in d:
-            _ensure_correct_block_data_type(v)
-        return
 
-    raise IncorrectBlockDataType(type(d))
+def skip_settings_block(data: QtCursor, block_id: SettingsBlock):
+    _block_decoder(block_id).skip(data)
 
 
-def read_settings_blocks(version, data: BytesIO) -> Dict[SettingsBlock, Any]:
+def read_settings_blocks(version, data: QtCursor) -> Dict[SettingsBlock, Any]:
+    data = as_qt_cursor(data)
     blocks = {}
 
     try:
-        while True:
+        while not data.at_end:
             block_id = SettingsBlock(read_qt_int32(data))
-            block_data = read_settings_block(version, data, block_id)
-            _ensure_correct_block_data_type(block_data)
-            blocks[block_id] = block_data
-    except StopIteration:
+            blocks[block_id] = read_settings_block(version, data, block_id)
+    except QtStreamTruncated:
+        # Incomplete trailing block.
         pass
 
     return blocks
+
+
+class SettingsIndex(Mapping):
+    """
+    Read-only mapping of settings blocks, decoded on first access.
+    ranges maps every block ID to its (start, end) offsets in data.
+    Decoding is recorded in the stats being collected when a block is
+    accessed, not when the index is created.
+    """
+
+    def __init__(
+        self,
+        version,
+        data,
+        ranges: Dict[SettingsBlock, Tuple[int, int]],
+    ):
+        self._version = version
+        self._data = memoryview(data)
+        self._ranges = ranges
+        self._decoded: Dict[SettingsBlock, Any] = {}
+
+    def __getitem__(self, block_id: SettingsBlock) -> Any:
+        try:
+            return self._decoded[block_id]
+        except KeyError:
+            pass
+
+        start, end = self._ranges[block_id]
+        block_cursor = QtCursor(self._data[start:end])
+        block_data = read_settings_block(self._version, block_cursor, block_id)
+
+        self._decoded[block_id] = block_data
+        return block_data
+
+    def __iter__(self) -> Iterator[SettingsBlock]:
+        return iter(self._ranges)
+
+    def decode_all(self) -> Dict[SettingsBlock, Any]:
+        """
+        Decodes every block, raising the error of the first malformed one.
+        """
+        return {block_id: self[block_id] for block_id in self._ranges}
+
+    def __len__(self) -> int:
+        return len(self._ranges)
+
+    def __reduce__(self):
+        return (
+            SettingsIndex,
+            (self._version, self._data.tobytes(), self._ranges),
+        )
+
+    def __repr__(self):
+        return f"SettingsIndex({list(self._ranges)})"
+
+
+@instrumented("settings_index")
+def index_settings_blocks(version, data: QtCursor) -> SettingsIndex:
+    """
+    Lazy counterpart of read_settings_blocks: one pass records the
+    byte range of every block, blocks are decoded when accessed.
+    """
+    data = as_qt_cursor(data)
+    ranges = {}
+
+    try:
+        while not data.at_end:
+            block_id = SettingsBlock(read_qt_int32(data))
+            start = data.offset
+            skip_settings_block(data, block_id)
+            ranges[block_id] = (start, data.offset)
+    except QtStreamTruncated:
+        # Incomplete trailing block.
+        pass
+
+    return SettingsIndex(version, data.data, ranges)
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import sqlite3
+
+from typing import Any, Iterable, List
+
+from tdesktop_decrypter.batch import BatchResult
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    error TEXT,
+    read_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY,
+    folder_id INTEGER NOT NULL REFERENCES folders(id) ON DELETE CASCADE,
+    account_index INTEGER NOT NULL,
+    user_id INTEGER,
+    current_dc_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS dc_keys (
+    account_id INTEGER NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+    dc_id INTEGER NOT NULL,
+    auth_key BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    folder_id INTEGER NOT NULL REFERENCES folders(id) ON DELETE CASCADE,
+    block TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS accounts_user_id ON accounts(user_id);
+CREATE INDEX IF NOT EXISTS accounts_folder_id ON accounts(folder_id);
+CREATE INDEX IF NOT EXISTS dc_keys_dc_id ON dc_keys(dc_id);
+CREATE INDEX IF NOT EXISTS dc_keys_account_id ON dc_keys(account_id);
+CREATE INDEX IF NOT EXISTS settings_folder_id ON settings(folder_id);
+"""
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def setting_to_json(value: Any) -> str:
+    return json.dumps(value, default=_json_default)
+
+
+class SqliteSink:
+    """
+    Writes BatchResults into a SQLite database.
+
+    Tables: folders (one row per tdata/ folder, error is NULL on success),
+    accounts (user_id, current_dc_id), dc_keys (auth_key per dc_id) and
+    settings (block name and JSON value). A folder written again replaces
+    its previous rows, so repeated runs update the database incrementally.
+    Rows are inserted in one transaction per batch_size folders.
+    """
+
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        self._batch_size = batch_size
+        self._pending: List[BatchResult] = []
+
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def write(self, result: BatchResult):
+        self._pending.append(result)
+
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def write_all(self, results: Iterable[BatchResult]) -> int:
+        count = 0
+
+        for result in results:
+            self.write(result)
+            count += 1
+
+        self.flush()
+        return count
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        # Paths are stored absolute, so a folder read from another working
+        # directory replaces its rows. The last result of a folder written
+        # twice in a batch wins.
+        pending = {os.path.abspath(result.path): result for result in self._pending}
+
+        read_at = time.time()
+        accounts = []
+        settings = []
+
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM folders WHERE path = ?",
+                ((path,) for path in pending),
+            )
+
+            for path, result in pending.items():
+                folder_id = self._db.execute(
+                    "INSERT INTO folders (path, error, read_at) VALUES (?, ?, ?)",
+                    (path, result.error, read_at),
+                ).lastrowid
+
+                if not result.ok:
+                    continue
+
+                parsed_tdata = result.parsed_tdata
+                accounts.extend(
+                    (folder_id, account) for account in parsed_tdata.accounts.values()
+                )
+
+                if parsed_tdata.settings is not None:
+                    settings.extend(
+                        (folder_id, str(block), setting_to_json(value))
+                        for block, value in parsed_tdata.settings.items()
+                    )
+
+            dc_keys = []
+
+            for folder_id, account in accounts:
+                account_id = self._db.execute(
+                    "INSERT INTO accounts"
+                    " (folder_id, account_index, user_id, current_dc_id)"
+                    " VALUES (?, ?, ?, ?)",
+                    (
+                        folder_id,
+                        account.index,
+                        account.mtp_data.user_id,
+                        account.mtp_data.current_dc_id,
+                    ),
+                ).lastrowid
+
+                dc_keys.extend(
+                    (account_id, dc_id, key)
+                    for dc_id, key in account.mtp_data.keys.items()
+                )
+
+            self._db.executemany(
+                "INSERT INTO dc_keys (account_id, dc_id, auth_key) VALUES (?, ?, ?)",
+                dc_keys,
+            )
+            self._db.executemany(
+                "INSERT INTO settings (folder_id, block, value) VALUES (?, ?, ?)",
+                settings,
+            )
+
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,125 @@
+import time
+import functools
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+class StageStats:
+    __slots__ = ("calls", "bytes", "wall_time", "cpu_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "bytes": self.bytes,
+            "wall_seconds": self.wall_time,
+            "cpu_seconds": self.cpu_time,
+        }
+
+    def __repr__(self):
+        return (
+            f"StageStats(calls={self.calls}, bytes={self.bytes}, "
+            f"wall_time={self.wall_time:.6f}, cpu_time={self.cpu_time:.6f})"
+        )
+
+
+class ReadStats:
+    """
+    Call counts, processed bytes and wall/CPU time of every reading stage.
+    CPU time is the time of the calling thread.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+
+    def record(self, stage: str, size: int = 0, wall_time: float = 0.0, cpu_time: float = 0.0):
+        try:
+            stage_stats = self.stages[stage]
+        except KeyError:
+            stage_stats = self.stages[stage] = StageStats()
+
+        stage_stats.calls += 1
+        stage_stats.bytes += size
+        stage_stats.wall_time += wall_time
+        stage_stats.cpu_time += cpu_time
+
+    def merge(self, other: "ReadStats"):
+        for stage, other_stats in other.stages.items():
+            try:
+                stage_stats = self.stages[stage]
+            except KeyError:
+                stage_stats = self.stages[stage] = StageStats()
+
+            stage_stats.calls += other_stats.calls
+            stage_stats.bytes += other_stats.bytes
+            stage_stats.wall_time += other_stats.wall_time
+            stage_stats.cpu_time += other_stats.cpu_time
+
+    def to_json(self) -> Dict[str, Any]:
+        return {stage: stats.to_json() for stage, stats in self.stages.items()}
+
+    def __repr__(self):
+        return f"ReadStats({self.stages!r})"
+
+
+_current_stats: ContextVar[Optional[ReadStats]] = ContextVar(
+    "tdesktop_decrypter_stats", default=None
+)
+
+
+def current_stats() -> Optional[ReadStats]:
+    return _current_stats.get()
+
+
+@contextmanager
+def collect_stats(stats: ReadStats = None) -> Iterator[ReadStats]:
+    """
+    Records the instrumented stages run in this context (thread or task) into stats.
+    """
+    if stats is None:
+        stats = ReadStats()
+
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def instrumented(stage: str, size: Callable[..., int] = None):
+    """
+    Decorator recording every call of the function as stage while stats are collected.
+    size is called with the result followed by the call arguments
+    and returns the number of processed bytes.
+    When no stats are collected the only cost is a context variable lookup.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _current_stats.get()
+            if stats is None:
+                return func(*args, **kwargs)
+
+            wall_started = time.perf_counter()
+            cpu_started = time.thread_time()
+
+            result = func(*args, **kwargs)
+
+            cpu_time = time.thread_time() - cpu_started
+            wall_time = time.perf_counter() - wall_started
+
+            processed = 0 if size is None else size(result, *args, **kwargs)
+            stats.record(stage, processed, wall_time, cpu_time)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -1,44 +1,66 @@
-from typing import Tuple, List
-from io import BytesIO
+from typing import Tuple, List, Optional
 
 from tdesktop_decrypter.tdf import RawTdfFile
-from tdesktop_decrypter.crypto import (
-    create_local_key,
-    create_legacy_local_key,
-    decrypt_local,
+from tdesktop_decrypter.crypto import decrypt_local
+from tdesktop_decrypter.key_cache import (
+    DerivedKeyCache,
+    cached_create_local_key,
+    cached_create_legacy_local_key,
+)
+from tdesktop_decrypter.qt import (
+    QtCursor,
+    as_qt_cursor,
+    read_qt_byte_array,
+    read_qt_byte_array_view,
+    read_qt_int32,
 )
-from tdesktop_decrypter.qt import read_qt_byte_array, read_qt_int32
 
 
-def decrypt_settings_tdf(settings_tdf: RawTdfFile):
-    encrypted_stream = BytesIO(settings_tdf.encrypted_data)
+def decrypt_settings_tdf(
+    settings_tdf: RawTdfFile, key_cache: Optional[DerivedKeyCache] = None
+) -> memoryview:
+    stream = QtCursor(settings_tdf.encrypted_data)
 
-    salt = read_qt_byte_array(encrypted_stream)
-    encrypted_settings = read_qt_byte_array(encrypted_stream)
+    salt = read_qt_byte_array(stream)
+    encrypted_settings = read_qt_byte_array_view(stream)
 
-    settings_key = create_legacy_local_key(b"", salt)
+    settings_key = cached_create_legacy_local_key(b"", salt, key_cache)
 
     return decrypt_local(encrypted_settings, settings_key)
 
 
-def decrypt_key_data_tdf(passcode: bytes, key_data_tdf: RawTdfFile):
-    stream = BytesIO(key_data_tdf.encrypted_data)
+def read_key_data_tdf(
+    key_data_tdf: RawTdfFile,
+) -> Tuple[bytes, memoryview, memoryview]:
+    stream = QtCursor(key_data_tdf.encrypted_data)
 
     salt = read_qt_byte_array(stream)
-    key_encrypted = read_qt_byte_array(stream)
-    info_encrypted = read_qt_byte_array(stream)
+    key_encrypted = read_qt_byte_array_view(stream)
+    info_encrypted = read_qt_byte_array_view(stream)
+
+    return salt, key_encrypted, info_encrypted
 
-    passcode_key = create_local_key(passcode, salt)
-    local_key = decrypt_local(key_encrypted, passcode_key)
+
+def decrypt_key_data_tdf(
+    passcode: bytes,
+    key_data_tdf: RawTdfFile,
+    key_cache: Optional[DerivedKeyCache] = None,
+) -> Tuple[bytes, memoryview]:
+    salt, key_encrypted, info_encrypted = read_key_data_tdf(key_data_tdf)
+
+    passcode_key = cached_create_local_key(passcode, salt, key_cache)
+    local_key = bytes(decrypt_local(key_encrypted, passcode_key))
 
     info_decrypted = decrypt_local(info_encrypted, local_key)
     return local_key, info_decrypted
 
 
-def read_key_data_accounts(data: BytesIO) -> Tuple[List[int], int]:
-    count = read_qt_int32(data)
+def read_key_data_accounts(data: QtCursor) -> Tuple[List[int], int]:
+    data = as_qt_cursor(data)
+
+    count = data.read_count(4)
 
-    indexes = [read_qt_int32(data) for _ in range(count)]
+    indexes = list(data.read_int32s(count))
 
     main_account = read_qt_int32(data)
 
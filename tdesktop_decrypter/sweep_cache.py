@@ -0,0 +1,184 @@
+import os
+import time
+import pickle
+import hashlib
+
+from typing import Dict, Optional, Tuple
+
+from tdesktop_decrypter.qt import QtLimitExceeded
+from tdesktop_decrypter.file_io import TdataFileSystem
+from tdesktop_decrypter.key_cache import DerivedKeyCache
+from tdesktop_decrypter.decrypter import ParsedTdata, TdataReader
+from tdesktop_decrypter.stats import ReadStats
+from tdesktop_decrypter.dedup import TdfDedupCache
+
+# (size, mtime_ns) of a file, None if it did not exist.
+FileFingerprint = Optional[Tuple[int, int]]
+
+
+class FingerprintingFileSystem(TdataFileSystem):
+    """
+    TdataFileSystem recording the fingerprint of every file it was asked for,
+    including the missing ones, by full path.
+    """
+
+    def __init__(self, base_path: str):
+        super().__init__(base_path)
+
+        self.fingerprints: Dict[str, FileFingerprint] = {}
+
+    def read_file(self, path: str) -> bytearray:
+        # Stat before reading: a file changing in between is fingerprinted
+        # older than its data and the entry is invalidated on the next lookup.
+        full_path = os.path.join(self._base_path, path)
+        self.fingerprints[full_path] = file_fingerprint(full_path)
+        return super().read_file(path)
+
+
+def file_fingerprint(path: str) -> FileFingerprint:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return st.st_size, st.st_mtime_ns
+
+
+class SweepCache:
+    """
+    On-disk cache of reading results of tdata/ folders.
+
+    An entry is keyed by (folder path, dataname, passcode) and holds the
+    fingerprints (size, mtime) of the files the read opened: key_data,
+    settings and the account files. It is used only while all of them are
+    unchanged. Entries are written atomically as soon as a folder is read,
+    so rerunning an interrupted batch skips the folders already done.
+    Failures other than OSError and QtLimitExceeded are cached too: they are
+    deterministic for unchanged files.
+
+    Entries hold decrypted auth keys: the directory is created with 0700
+    permissions and every entry with 0600. They are pickles and must
+    only be loaded from a trusted directory.
+    """
+
+    def __init__(self, directory: str):
+        self._directory = directory
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+
+    def read(
+        self,
+        path: str,
+        passcode: str = None,
+        key_cache: DerivedKeyCache = None,
+        with_settings: bool = True,
+        with_stats: bool = False,
+        dataname: str = None,
+        dedup: TdfDedupCache = None,
+    ) -> Tuple[Optional[ParsedTdata], Optional[str]]:
+        """
+        Returns (parsed_tdata, error) from the cache, or reads the folder and caches it.
+        With with_stats = True the stats of a cached result only hold
+        the sweep_cache_hit stage.
+        """
+        started = time.perf_counter()
+        name = self._entry_name(path, dataname, passcode)
+
+        cached = self._get(name, with_settings)
+        if cached is not None:
+            parsed_tdata, error = cached
+
+            if parsed_tdata is not None:
+                parsed_tdata.stats = None
+
+                if with_stats:
+                    parsed_tdata.stats = ReadStats()
+                    parsed_tdata.stats.record(
+                        "sweep_cache_hit", wall_time=time.perf_counter() - started
+                    )
+
+            return cached
+
+        io = FingerprintingFileSystem(path)
+        parsed_tdata, error = None, None
+
+        try:
+            parsed_tdata = TdataReader(io, dataname, key_cache, dedup).read(
+                passcode, with_settings, with_stats
+            )
+        except (OSError, QtLimitExceeded) as exc:
+            # Possibly transient, or depending on the parse_limits of this run:
+            # not cached.
+            return None, f"{type(exc).__name__}: {exc}"
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+
+        self._put(name, io.fingerprints, with_settings, parsed_tdata, error)
+        return parsed_tdata, error
+
+    def _entry_name(
+        self, path: str, dataname: Optional[str], passcode: Optional[str]
+    ) -> str:
+        h = hashlib.sha256()
+
+        fields = (
+            os.path.abspath(path),
+            dataname or TdataReader.DEFAULT_DATANAME,
+            passcode or "",
+        )
+        for field in fields:
+            field = field.encode()
+            h.update(len(field).to_bytes(4, "little"))
+            h.update(field)
+
+        return h.hexdigest()
+
+    def _get(
+        self, name: str, with_settings: bool
+    ) -> Optional[Tuple[Optional[ParsedTdata], Optional[str]]]:
+        try:
+            with open(os.path.join(self._directory, name), "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or foreign entry, read again.
+            return None
+
+        if with_settings and not entry["with_settings"]:
+            return None
+
+        for path, fingerprint in entry["fingerprints"].items():
+            if file_fingerprint(path) != fingerprint:
+                return None
+
+        parsed_tdata = entry["parsed_tdata"]
+        if parsed_tdata is not None and not with_settings:
+            parsed_tdata.settings = None
+
+        return parsed_tdata, entry["error"]
+
+    def _put(
+        self,
+        name: str,
+        fingerprints: Dict[str, FileFingerprint],
+        with_settings: bool,
+        parsed_tdata: Optional[ParsedTdata],
+        error: Optional[str],
+    ):
+        entry = {
+            "fingerprints": fingerprints,
+            "with_settings": with_settings,
+            "parsed_tdata": parsed_tdata,
+            "error": error,
+        }
+
+        path = os.path.join(self._directory, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f)
+
+        os.replace(tmp_path, path)
@@ -1,5 +1,9 @@
 import hashlib
 
+from typing import BinaryIO, Iterator, Tuple
+
+from tdesktop_decrypter.stats import instrumented
+
 TDF_MAGIC = b"TDF$"
 
 
@@ -21,8 +25,48 @@ class RawTdfFile:
         self.encrypted_data = None
         self.hashsum = None
 
+    def __getstate__(self):
+        # encrypted_data is usually a memoryview, which cannot be pickled.
+        state = self.__dict__.copy()
+        if isinstance(state["encrypted_data"], memoryview):
+            state["encrypted_data"] = state["encrypted_data"].tobytes()
+
+        return state
+
+
+def _tdf_hashsum_finish(md5, size: int, version: int) -> bytes:
+    md5.update(size.to_bytes(4, "little"))
+    md5.update(version.to_bytes(4, "little"))
+    md5.update(TDF_MAGIC)
+    return md5.digest()
+
 
+def _tdf_hashsum(encrypted_data, version: int) -> bytes:
+    return _tdf_hashsum_finish(
+        hashlib.md5(encrypted_data), len(encrypted_data), version
+    )
+
+
+def serialize_tdf(version: int, encrypted_data: bytes) -> bytes:
+    """
+    Inverse of parse_raw_tdf.
+    """
+    return (
+        TDF_MAGIC
+        + version.to_bytes(4, "little")
+        + encrypted_data
+        + _tdf_hashsum(encrypted_data, version)
+    )
+
+
+@instrumented("parse_raw_tdf", size=lambda result, data: len(data))
 def parse_raw_tdf(data: bytes) -> RawTdfFile:
+    """
+    data is any bytes-like object. encrypted_data is a memoryview into it,
+    so the file is not copied.
+    """
+    data = memoryview(data)
+
     if data[:4] != TDF_MAGIC:
         raise WrongMagicTdfParserError("Wrong magic. Not a TDF file?")
 
@@ -30,16 +74,48 @@ def parse_raw_tdf(data: bytes) -> RawTdfFile:
 
     tdf.version = int.from_bytes(data[4:8], "little")
     tdf.encrypted_data = data[8:-16]
-    tdf.hashsum = data[-16:]
-
-    actual_md5 = hashlib.md5(
-        tdf.encrypted_data
-        + len(tdf.encrypted_data).to_bytes(4, "little")
-        + tdf.version.to_bytes(4, "little")
-        + TDF_MAGIC
-    ).digest()
+    tdf.hashsum = bytes(data[-16:])
 
-    if actual_md5 != tdf.hashsum:
+    if _tdf_hashsum(tdf.encrypted_data, tdf.version) != tdf.hashsum:
         raise WrongHashsumTdfParserError("Wrong hashsum. Corrupted file?")
 
     return tdf
+
+
+def stream_raw_tdf(
+    f: BinaryIO, size: int, chunk_size: int
+) -> Tuple[int, Iterator[bytes]]:
+    """
+    Streaming counterpart of parse_raw_tdf for a file object of size bytes
+    positioned at its start. Returns the version and an iterator over
+    encrypted_data in chunks of at most chunk_size bytes.
+    The hashsum is checked after the last chunk.
+    """
+    header = f.read(8)
+
+    if header[:4] != TDF_MAGIC:
+        raise WrongMagicTdfParserError("Wrong magic. Not a TDF file?")
+
+    data_size = size - len(header) - 16
+    if len(header) < 8 or data_size < 0:
+        raise TdfParserError("File is too short")
+
+    version = int.from_bytes(header[4:8], "little")
+
+    def read_chunks() -> Iterator[bytes]:
+        md5 = hashlib.md5()
+        remaining = data_size
+
+        while remaining:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                raise TdfParserError("File is truncated")
+
+            md5.update(chunk)
+            remaining -= len(chunk)
+            yield chunk
+
+        if _tdf_hashsum_finish(md5, data_size, version) != f.read(16):
+            raise WrongHashsumTdfParserError("Wrong hashsum. Corrupted file?")
+
+    return version, read_chunks()
@@ -0,0 +1,175 @@
+import posixpath
+
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from tdesktop_decrypter.qt import QtCursor, read_qt_byte_array, read_qt_byte_array_view
+from tdesktop_decrypter.tdf import RawTdfFile
+from tdesktop_decrypter.file_io import TdataFileIo, TdataFileSystem
+from tdesktop_decrypter.crypto import CryptoException
+from tdesktop_decrypter.decrypter import TdataReader
+from tdesktop_decrypter.archive_io import open_tdata_archive
+from tdesktop_decrypter.storage import (
+    decrypt_key_data_tdf,
+    read_key_data_accounts,
+    read_key_data_tdf,
+)
+
+SALT_SIZE = 32
+
+
+class TdataVerifyException(Exception):
+    pass
+
+
+class TriageRecord:
+    def __init__(self):
+        self.path: str = None
+        # Why key_data is missing or invalid. The fields below are unset when
+        # key_data could not be parsed.
+        self.error: Optional[str] = None
+        self.version: Optional[int] = None
+        self.has_settings: bool = False
+        self.settings_error: Optional[str] = None
+        # None when the empty passcode was not tried.
+        self.passcode_set: Optional[bool] = None
+        # Account indexes listed by key_data, known only without a passcode.
+        self.accounts: Optional[List[int]] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.settings_error is None
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "error": self.error,
+            "version": self.version,
+            "has_settings": self.has_settings,
+            "settings_error": self.settings_error,
+            "passcode_set": self.passcode_set,
+            "accounts": self.accounts,
+        }
+
+    def __repr__(self):
+        return f"TriageRecord(path={self.path!r}, error={self.error!r})"
+
+
+def _check_encrypted_size(name: str, encrypted) -> None:
+    # msg_key followed by at least one AES block.
+    if len(encrypted) < 32 or len(encrypted) % 16:
+        raise TdataVerifyException(f"{name} has a wrong size: {len(encrypted)}")
+
+
+def _check_salt(salt: bytes) -> None:
+    if len(salt) != SALT_SIZE:
+        raise TdataVerifyException(f"salt has a wrong size: {len(salt)}")
+
+
+def check_key_data_framing(key_data_tdf: RawTdfFile) -> None:
+    salt, key_encrypted, info_encrypted = read_key_data_tdf(key_data_tdf)
+
+    _check_salt(salt)
+    _check_encrypted_size("key_encrypted", key_encrypted)
+    _check_encrypted_size("info_encrypted", info_encrypted)
+
+
+def check_settings_framing(settings_tdf: RawTdfFile) -> None:
+    stream = QtCursor(settings_tdf.encrypted_data)
+
+    _check_salt(read_qt_byte_array(stream))
+    _check_encrypted_size("settings", read_qt_byte_array_view(stream))
+
+
+def verify_tdata(
+    path: str,
+    dataname: str = None,
+    check_passcode: bool = True,
+    io: TdataFileIo = None,
+) -> TriageRecord:
+    """
+    Cheap integrity checks of a tdata/ folder, without decrypting the settings
+    nor deriving a passcode key: the TDF magic and hashsum of key_data and
+    settings and the framing of their byte arrays.
+    With check_passcode the empty passcode is tried, its key derivation is a
+    single PBKDF2 iteration: on success the account indexes are listed,
+    otherwise passcode_set is True.
+    io defaults to the tdata/ folder at path.
+    """
+    record = TriageRecord()
+    record.path = path
+
+    if io is None:
+        io = TdataFileSystem(path)
+
+    reader = TdataReader(io, dataname)
+
+    try:
+        key_data_tdf = reader.read_key_data_tdf()
+        check_key_data_framing(key_data_tdf)
+    except Exception as exc:
+        record.error = f"{type(exc).__name__}: {exc}"
+        return record
+
+    record.version = key_data_tdf.version
+
+    try:
+        check_settings_framing(io.read_tdf_file("settings"))
+        record.has_settings = True
+    except FileNotFoundError:
+        pass
+    except Exception as exc:
+        record.has_settings = True
+        record.settings_error = f"{type(exc).__name__}: {exc}"
+
+    if check_passcode:
+        try:
+            _, info = decrypt_key_data_tdf(b"", key_data_tdf)
+            record.passcode_set = False
+            record.accounts, _ = read_key_data_accounts(QtCursor(info))
+        except CryptoException:
+            record.passcode_set = True
+        except Exception as exc:
+            # Decrypted but malformed, e.g. a bogus account count.
+            record.error = f"{type(exc).__name__}: {exc}"
+
+    return record
+
+
+def verify_tdata_dirs(
+    paths: Iterable[str],
+    workers: int = None,
+    dataname: str = None,
+    check_passcode: bool = True,
+) -> Iterator[TriageRecord]:
+    """
+    Verifies every tdata/ folder in a pool of workers threads
+    and yields the records in input order.
+    The folders are verified in copies of the calling context, so parse_limits
+    of the caller apply.
+    """
+    verify = partial(verify_tdata, dataname=dataname, check_passcode=check_passcode)
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(copy_context().run, verify, path) for path in paths]
+
+        for future in futures:
+            yield future.result()
+
+
+def verify_archive(
+    path: str, dataname: str = None, check_passcode: bool = True
+) -> Iterator[TriageRecord]:
+    """
+    Verifies every tdata/ folder of an archive, see read_archive.
+    """
+    with open_tdata_archive(path) as archive:
+        for tdata_dir in archive.tdata_dirs():
+            yield verify_tdata(
+                posixpath.join(path, tdata_dir) if tdata_dir else path,
+                dataname,
+                check_passcode,
+                archive.file_io(tdata_dir),
+            )